@@ -8,15 +8,28 @@ from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import A4
 from reportlab.lib import colors
 import os
-import tempfile
+import sys
+import json
+import hashlib
 import logging
-from PIL import Image
+import argparse
+import tempfile
+import time
 from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from image_pipeline import iter_prepared_images, image_reader
+from derivative_cache import DerivativeCache
+from page_chrome import get_logo, stamp_form
+from size_budget import SizeBudget, parse_size
+from folder_watch import FolderWatcher, scan_images
+from pdf_setup import configure_reportlab
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+configure_reportlab()
+
 # PDF Configuration Constants
 PAGE_WIDTH, PAGE_HEIGHT = A4
 IMAGE_MAX_WIDTH = 260  # Maksimal bredde for hvert billede
@@ -28,16 +41,45 @@ ROWS = 2  # Antal rækker
 LOGO_PATH = "logo.png"  # Sti til logoet
 HEADER_LOGO_WIDTH = 100  # Bredde af logo i header
 HEADER_LOGO_HEIGHT = 30  # Højde af logo i header
+COVER_LOGO_WIDTH = 314  # Bredde af logo på forsiden
+COVER_LOGO_HEIGHT = 98  # Højde af logo på forsiden
+HEADER_FORM_NAME = "PageHeader"  # Navn på genbrugelig header i PDF'en
 JPEG_QUALITY = 85  # JPEG-kvalitet for komprimering (0-100)
+IMAGE_DPI = 72  # Opløsning for indlejrede billeder (72 = 1 pixel pr. punkt)
+PREPROCESS_WORKERS = os.cpu_count() or 1  # Antal processer til billedforberedelse
+DERIVATIVE_CACHE_DIR = "derivative_cache"  # Mappe med færdigbehandlede billeder
+DERIVATIVE_CACHE_MAX_BYTES = 512 * 1024 * 1024  # Maksimal størrelse af cachen (512MB)
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.gif')  # Understøttede billedformater
+
+# Batch-tilstand
+BATCH_OUTPUT_NAME = "photo_documentation.pdf"  # PDF-navn når PDF'en gemmes i billedmappen
+BATCH_MANIFEST_PATH = "batch_manifest.json"  # Husker hvilke mapper der allerede er genereret
+BATCH_PROCESSES = os.cpu_count() or 1  # Antal mapper der genereres samtidigt
+
+# Watch-tilstand
+WATCH_INTERVAL = 1.0  # Sekunder mellem hver gennemgang af mapperne
+WATCH_DEBOUNCE = 2.0  # Sekunder uden ændringer før PDF'en genereres igen
+
+# Cache af behandlede billeder, så uændrede billeder ikke behandles igen
+derivative_cache = DerivativeCache(DERIVATIVE_CACHE_DIR, DERIVATIVE_CACHE_MAX_BYTES)
+
+def get_cover_logo():
+    """Logoet indlæses én gang pr. proces i den største størrelse det bruges i"""
+    return get_logo(LOGO_PATH, COVER_LOGO_WIDTH, COVER_LOGO_HEIGHT)
+
+def draw_header(c):
+    """Tegn headerens indhold; gemmes som genbrugelig form i PDF'en"""
+    logo = get_cover_logo()
+    if logo is not None:
+        c.drawImage(logo, MARGIN_X, PAGE_HEIGHT - MARGIN_Y + 20,
+                   width=HEADER_LOGO_WIDTH, height=HEADER_LOGO_HEIGHT, mask='auto')
+    c.setFont("Helvetica-Bold", 12)
+    c.drawString(MARGIN_X + HEADER_LOGO_WIDTH + 10, PAGE_HEIGHT - MARGIN_Y + 30, "Fotodokumentation")
 
 def add_header(c):
     """Tilføj header med logo"""
     try:
-        if os.path.exists(LOGO_PATH):
-            c.drawImage(LOGO_PATH, MARGIN_X, PAGE_HEIGHT - MARGIN_Y + 20, 
-                       width=HEADER_LOGO_WIDTH, height=HEADER_LOGO_HEIGHT, mask='auto')
-        c.setFont("Helvetica-Bold", 12)
-        c.drawString(MARGIN_X + HEADER_LOGO_WIDTH + 10, PAGE_HEIGHT - MARGIN_Y + 30, "Fotodokumentation")
+        stamp_form(c, HEADER_FORM_NAME, draw_header)
     except Exception as e:
         logger.warning(f"Kunne ikke tilføje header: {e}")
 
@@ -50,19 +92,24 @@ def add_footer(c):
     except Exception as e:
         logger.warning(f"Kunne ikke tilføje footer: {e}")
 
-def create_pdf_with_grid_layout(folder_path, output_pdf="photo_documentation.pdf"):
+def find_images(folder_path):
+    """Stier til alle billedfiler i en mappe"""
+    return [os.path.join(folder_path, f) for f in os.listdir(folder_path)
+            if f.lower().endswith(IMAGE_EXTENSIONS)]
+
+def create_pdf_with_grid_layout(folder_path, output_pdf="photo_documentation.pdf", workers=PREPROCESS_WORKERS,
+                                image_paths=None, verbose=True, prepared_hook=None):
     """
     Generer PDF med billeder og kommentarfelter
     Forbedret version med bedre fejlhåndtering
+    Billederne forberedes parallelt i `workers` processer; selve PDF'en bygges sekventielt
+    Er image_paths allerede fundet, læses mappen ikke igen
+    prepared_hook(image_paths, prepared_images) kan udskifte de forberedte billeder
     """
-    # Find alle billedfiler
-    image_extensions = ('.jpg', '.jpeg', '.png', '.bmp', '.gif')
-    image_paths = []
-    
     try:
-        for f in os.listdir(folder_path):
-            if f.lower().endswith(image_extensions):
-                image_paths.append(os.path.join(folder_path, f))
+        # Find alle billedfiler
+        if image_paths is None:
+            image_paths = find_images(folder_path)
         
         if not image_paths:
             print("❌ Ingen billeder fundet i mappen.")
@@ -87,9 +134,10 @@ def create_pdf_with_grid_layout(folder_path, output_pdf="photo_documentation.pdf
         c._pageNumber = 1
 
         # Opret forside
-        if os.path.exists(LOGO_PATH):
-            c.drawImage(LOGO_PATH, PAGE_WIDTH / 2 - 314 / 2, PAGE_HEIGHT / 2, 
-                       width=314, height=98, mask='auto')
+        logo = get_cover_logo()
+        if logo is not None:
+            c.drawImage(logo, PAGE_WIDTH / 2 - COVER_LOGO_WIDTH / 2, PAGE_HEIGHT / 2,
+                       width=COVER_LOGO_WIDTH, height=COVER_LOGO_HEIGHT, mask='auto')
         c.setFont("Helvetica-Bold", 24)
         c.drawCentredString(PAGE_WIDTH / 2, PAGE_HEIGHT / 2 - 150, "Fotodokumentation")
         c.setFont("Helvetica", 16)
@@ -107,9 +155,19 @@ def create_pdf_with_grid_layout(folder_path, output_pdf="photo_documentation.pdf
 
         image_counter = 0
         processed_images = 0
-        
-        for i, image_path in enumerate(image_paths):
+
+        # Forbered billeder parallelt; resultaterne kommer i samme rækkefølge
+        prepared_images = iter_prepared_images(image_paths, IMAGE_MAX_WIDTH, IMAGE_MAX_HEIGHT,
+                                               JPEG_QUALITY, dpi=IMAGE_DPI, workers=workers,
+                                               cache=derivative_cache)
+        if prepared_hook is not None:
+            prepared_images = prepared_hook(image_paths, prepared_images)
+
+        for i, (image_path, (prepared, error)) in enumerate(zip(image_paths, prepared_images)):
             try:
+                if error is not None:
+                    raise error
+
                 # Beregn position
                 row = image_counter // COLUMNS % ROWS
                 col = image_counter % COLUMNS
@@ -125,30 +183,11 @@ def create_pdf_with_grid_layout(folder_path, output_pdf="photo_documentation.pdf
                 y = PAGE_HEIGHT - MARGIN_Y - row * (IMAGE_MAX_HEIGHT + 0 + gap_y) - IMAGE_MAX_HEIGHT
 
                 # Indsæt billede
-                with Image.open(image_path) as img:
-                    # Konverter til RGB hvis nødvendigt
-                    if img.mode in ('RGBA', 'LA', 'P'):
-                        background = Image.new('RGB', img.size, (255, 255, 255))
-                        if img.mode == 'P':
-                            img = img.convert('RGBA')
-                        background.paste(img, mask=img.split()[-1] if img.mode in ('RGBA', 'LA') else None)
-                        img = background
-                    elif img.mode != 'RGB':
-                        img = img.convert('RGB')
-                    
-                    img.thumbnail((IMAGE_MAX_WIDTH, IMAGE_MAX_HEIGHT))
-                    img_width, img_height = img.size
-                    
-                    x_adjusted = x + (IMAGE_MAX_WIDTH - img_width) / 2
-                    y_adjusted = y + (IMAGE_MAX_HEIGHT - img_height) / 2
-                    
-                    # Gem billede midlertidigt for PDF
-                    with tempfile.NamedTemporaryFile(suffix=".jpg", delete=False) as tmp_file:
-                        temp_image_path = tmp_file.name
-                        img.save(temp_image_path, format="JPEG", quality=JPEG_QUALITY, optimize=True)
-                
-                c.drawImage(temp_image_path, x_adjusted, y_adjusted, width=img_width, height=img_height)
-                os.remove(temp_image_path)
+                jpeg_data, img_width, img_height = prepared
+                x_adjusted = x + (IMAGE_MAX_WIDTH - img_width) / 2
+                y_adjusted = y + (IMAGE_MAX_HEIGHT - img_height) / 2
+
+                c.drawImage(image_reader(jpeg_data), x_adjusted, y_adjusted, width=img_width, height=img_height)
                 processed_images += 1
                 
                 # Tilføj kommentarlinje
@@ -170,7 +209,8 @@ def create_pdf_with_grid_layout(folder_path, output_pdf="photo_documentation.pdf
                 )
                 
                 image_counter += 1
-                print(f"✅ Behandlet: {os.path.basename(image_path)}")
+                if verbose:
+                    print(f"✅ Behandlet: {os.path.basename(image_path)}")
                 
             except Exception as e:
                 print(f"⚠️  Fejl ved behandling af '{os.path.basename(image_path)}': {e}")
@@ -181,8 +221,11 @@ def create_pdf_with_grid_layout(folder_path, output_pdf="photo_documentation.pdf
         add_footer(c)
         c.save()
         
-        print(f"✅ PDF genereret succesfuldt!")
-        print(f"📊 Billeder behandlet: {processed_images}/{len(image_paths)}")
+        if verbose:
+            print(f"✅ PDF genereret succesfuldt!")
+            print(f"📊 Billeder behandlet: {processed_images}/{len(image_paths)}")
+            cache_stats = derivative_cache.stats()
+            print(f"📦 Cache: {cache_stats['hits']} genbrugt, {cache_stats['misses']} behandlet")
         logger.info("PDF generated successfully: %s with %d images", output_pdf, processed_images)
         return output_pdf
         
@@ -191,6 +234,21 @@ def create_pdf_with_grid_layout(folder_path, output_pdf="photo_documentation.pdf
         logger.error("Error generating PDF: %s", e)
         return None
 
+def create_pdf_within_budget(folder_path, output_pdf, max_bytes, verbose=True, **options):
+    """
+    Som create_pdf_with_grid_layout, men billederne genkodes med lavere kvalitet
+    eller opløsning indtil PDF'en højst fylder max_bytes
+    """
+    budget = SizeBudget(max_bytes, IMAGE_MAX_WIDTH, IMAGE_MAX_HEIGHT, IMAGE_DPI)
+    # Kun første gennemløb udskriver de behandlede billeder
+    output_pdf = budget.render(
+        lambda prepared_hook, first_pass: create_pdf_with_grid_layout(
+            folder_path, output_pdf, verbose=verbose and first_pass, prepared_hook=prepared_hook, **options),
+        output_pdf)
+    if output_pdf and verbose and os.path.getsize(output_pdf) > max_bytes:
+        print(f"⚠️  PDF'en kunne ikke komme under {max_bytes / (1024 * 1024):.2f} MB")
+    return output_pdf
+
 def validate_environment():
     """Valider at miljøet er korrekt konfigureret"""
     errors = []
@@ -205,8 +263,292 @@ def validate_environment():
     
     return errors
 
-def main():
+def find_image_folders(root):
+    """Alle mapper under root (inkl. root) der indeholder billeder, i sorteret rækkefølge"""
+    folders = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        # Spring skjulte mapper og cachen over
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith('.') and d != DERIVATIVE_CACHE_DIR)
+        if any(f.lower().endswith(IMAGE_EXTENSIONS) for f in filenames):
+            folders.append(dirpath)
+    return folders
+
+def folder_fingerprint(image_paths, max_bytes=None):
+    """
+    Fingeraftryk af en mappes billeder (navn, størrelse og ændringstid) og de
+    indstillinger der påvirker PDF'en; ændres det, skal mappen genereres igen
+    """
+    digest = hashlib.sha256()
+    digest.update(f"{IMAGE_MAX_WIDTH}|{IMAGE_MAX_HEIGHT}|{JPEG_QUALITY}|{IMAGE_DPI}|{COLUMNS}x{ROWS}\n".encode())
+    if max_bytes is not None:
+        digest.update(f"max_bytes|{max_bytes}\n".encode())
+    for path in sorted(image_paths):
+        st = os.stat(path)
+        digest.update(f"{os.path.basename(path)}|{st.st_size}|{st.st_mtime_ns}\n".encode())
+    return digest.hexdigest()
+
+def batch_output_path(folder, output_dir, base_dir):
+    """PDF-sti for en mappe: i selve mappen, eller i output_dir navngivet efter mappens relative sti"""
+    if output_dir is None:
+        return os.path.join(folder, BATCH_OUTPUT_NAME)
+    relative = os.path.relpath(folder, base_dir)
+    name = os.path.basename(os.path.abspath(folder)) if relative == '.' else relative.replace(os.sep, '_')
+    return os.path.join(output_dir, f"{name}.pdf")
+
+def load_manifest(manifest_path):
+    try:
+        with open(manifest_path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logger.warning("Could not read manifest %s, starting over: %s", manifest_path, e)
+        return {}
+
+def save_manifest(manifest_path, manifest):
+    """Skriv manifestet atomisk, så et afbrudt run ikke efterlader en halv fil"""
+    directory = os.path.dirname(os.path.abspath(manifest_path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+def render_atomically(output_pdf, render):
+    """
+    Kald render(midlertidig sti) og erstat først output_pdf når den nye PDF er
+    færdig, så ingen åbner en halvt skrevet fil i en delt mappe
+    """
+    # Ikke mkstemp: den opretter filen kun læsbar for ejeren
+    directory, name = os.path.split(os.path.abspath(output_pdf))
+    tmp_path = os.path.join(directory, f".{name}.{os.getpid()}.tmp")
+    try:
+        if render(tmp_path) is None:
+            return None
+        os.replace(tmp_path, output_pdf)
+        return output_pdf
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def render_folder(folder, image_paths, output_pdf, workers, max_bytes=None):
+    """Procespuljens opgave: generer PDF for én mappe"""
+    def render(path):
+        if max_bytes is not None:
+            return create_pdf_within_budget(folder, path, max_bytes, verbose=False, workers=workers,
+                                            image_paths=image_paths)
+        return create_pdf_with_grid_layout(folder, output_pdf=path, workers=workers,
+                                           image_paths=image_paths, verbose=False)
+    return render_atomically(output_pdf, render)
+
+def run_batch(folders, output_dir=None, processes=BATCH_PROCESSES, manifest_path=BATCH_MANIFEST_PATH,
+              force=False, max_bytes=None):
+    """
+    Generer én PDF pr. mappe fordelt på `processes` processer.
+    Mapper hvis billeder ikke er ændret siden sidste kørsel springes over.
+    Med max_bytes holdes hver PDF under den størrelse.
+    Returnerer antallet af mapper der fejlede.
+    """
+    manifest = load_manifest(manifest_path)
+    base_dir = os.path.commonpath([os.path.abspath(folder) for folder in folders]) if folders else '.'
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+
+    # Find arbejdet; hver mappe læses kun én gang
+    jobs = []
+    skipped = 0
+    for folder in folders:
+        try:
+            image_paths = find_images(folder)
+        except OSError as e:
+            print(f"⚠️  Kan ikke læse '{folder}': {e}")
+            continue
+        if not image_paths:
+            continue
+
+        key = os.path.abspath(folder)
+        fingerprint = folder_fingerprint(image_paths, max_bytes)
+        output_pdf = batch_output_path(folder, output_dir, base_dir)
+        previous = manifest.get(key)
+        if (not force and previous is not None and previous['fingerprint'] == fingerprint
+                and previous['output'] == os.path.abspath(output_pdf) and os.path.exists(output_pdf)):
+            skipped += 1
+            continue
+        jobs.append((key, image_paths, output_pdf, fingerprint))
+
+    print(f"📂 {len(jobs)} mapper skal genereres, {skipped} er uændrede")
+    if not jobs:
+        return 0
+
+    # Billedforberedelsen deler CPU'erne med de andre mapper
+    processes = max(1, min(processes, len(jobs)))
+    image_workers = max(1, PREPROCESS_WORKERS // processes)
+
+    def record(job, output):
+        key, image_paths, output_pdf, fingerprint = job
+        if output is None:
+            print(f"❌ {key}")
+            return False
+        manifest[key] = {
+            'fingerprint': fingerprint,
+            'output': os.path.abspath(output),
+            'images': len(image_paths),
+            'generated_at': datetime.now().isoformat(timespec='seconds'),
+        }
+        save_manifest(manifest_path, manifest)
+        print(f"✅ {key} -> {output}")
+        return True
+
+    failed = 0
+    if processes == 1:
+        for job in jobs:
+            key, image_paths, output_pdf, _ = job
+            if not record(job, render_folder(key, image_paths, output_pdf, image_workers, max_bytes)):
+                failed += 1
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            futures = {executor.submit(render_folder, job[0], job[1], job[2], image_workers, max_bytes): job
+                       for job in jobs}
+            for future in as_completed(futures):
+                try:
+                    output = future.result()
+                except Exception as e:
+                    logger.error("Batch job for %s failed: %s", futures[future][0], e)
+                    output = None
+                if not record(futures[future], output):
+                    failed += 1
+
+    print(f"\n📊 {len(jobs) - failed} genereret, {failed} fejlede, {skipped} sprunget over")
+    return failed
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Fotodokumentation Generator. Uden argumenter genereres photo_documentation.pdf "
+                    "fra mappen 'billeder'; med mapper eller --root genereres én PDF pr. mappe.")
+    parser.add_argument('folders', nargs='*', help="billedmapper der hver skal have sin egen PDF")
+    parser.add_argument('--root', action='append', default=[],
+                        help="gennemsøg mappen rekursivt og lav én PDF pr. mappe med billeder")
+    parser.add_argument('--output-dir',
+                        help="gem PDF'erne her i stedet for som photo_documentation.pdf i hver mappe")
+    parser.add_argument('--processes', type=int, default=BATCH_PROCESSES,
+                        help=f"antal mapper der genereres samtidigt (standard: {BATCH_PROCESSES})")
+    parser.add_argument('--manifest', default=BATCH_MANIFEST_PATH,
+                        help=f"manifest over genererede mapper (standard: {BATCH_MANIFEST_PATH})")
+    parser.add_argument('--force', action='store_true', help="generer alle mapper, også uændrede")
+    parser.add_argument('--max-size', type=parse_max_size, metavar='STØRRELSE',
+                        help="maksimal PDF-størrelse, f.eks. 10MB; billederne komprimeres hårdere indtil "
+                             "PDF'en passer")
+    parser.add_argument('--watch', action='store_true',
+                        help="bliv ved med at køre og generer PDF'en igen når billeder tilføjes, ændres eller slettes")
+    parser.add_argument('--interval', type=float, default=WATCH_INTERVAL,
+                        help=f"sekunder mellem hver gennemgang af mapperne i watch-tilstand (standard: {WATCH_INTERVAL})")
+    parser.add_argument('--debounce', type=float, default=WATCH_DEBOUNCE,
+                        help=f"sekunder uden ændringer før der genereres igen (standard: {WATCH_DEBOUNCE})")
+    return parser.parse_args(argv)
+
+def parse_max_size(text):
+    """argparse-type for --max-size"""
+    try:
+        return parse_size(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"ugyldig størrelse: '{text}' (brug f.eks. 10MB eller 800KB)")
+
+def batch_main(args):
+    """Batch-tilstand: én PDF pr. mappe"""
+    print("📸 Fotodokumentation Generator - Batch")
+    print("="*50)
+
+    if not os.path.exists(LOGO_PATH):
+        print(f"⚠️  Logo ikke fundet: {LOGO_PATH}")
+
+    folders = list(args.folders)
+    for root in args.root:
+        folders.extend(find_image_folders(root))
+    if not folders:
+        print("❌ Ingen mapper med billeder fundet")
+        return 1
+
+    failed = run_batch(folders, output_dir=args.output_dir, processes=args.processes,
+                       manifest_path=args.manifest, force=args.force, max_bytes=args.max_size)
+    return 1 if failed else 0
+
+def watch_main(args):
+    """
+    Watch-tilstand: mapperne gennemgås med faste mellemrum, og PDF'erne genereres
+    igen når billederne har været uændrede i args.debounce sekunder. Uændrede
+    billeder hentes fra cachen, så kun nye og ændrede billeder behandles.
+    """
+    print("📸 Fotodokumentation Generator - Watch")
+    print("="*50)
+
+    if not os.path.exists(LOGO_PATH):
+        print(f"⚠️  Logo ikke fundet: {LOGO_PATH}")
+
+    if args.folders or args.root:
+        def scan():
+            snapshot = {}
+            for folder in args.folders:
+                snapshot.update(scan_images(folder, IMAGE_EXTENSIONS))
+            for root in args.root:
+                snapshot.update(scan_images(root, IMAGE_EXTENSIONS, recursive=True,
+                                            skip_dirs=(DERIVATIVE_CACHE_DIR,)))
+            return snapshot
+
+        def rebuild():
+            # Manifestet sørger for at kun ændrede mapper genereres
+            folders = list(args.folders)
+            for root in args.root:
+                folders.extend(find_image_folders(root))
+            run_batch(folders, output_dir=args.output_dir, processes=args.processes,
+                      manifest_path=args.manifest, max_bytes=args.max_size)
+        watched = ', '.join(args.folders + args.root)
+    else:
+        folder_path = "billeder"
+        output_pdf = "photo_documentation.pdf"
+
+        def scan():
+            return scan_images(folder_path, IMAGE_EXTENSIONS)
+
+        def rebuild():
+            image_paths = find_images(folder_path) if os.path.isdir(folder_path) else []
+            if not image_paths:
+                print(f"⚠️  Ingen billeder i '{folder_path}'; {output_pdf} er ikke opdateret")
+                return
+            def render(path):
+                if args.max_size is not None:
+                    return create_pdf_within_budget(folder_path, path, args.max_size, verbose=False,
+                                                    image_paths=image_paths)
+                return create_pdf_with_grid_layout(folder_path, path, image_paths=image_paths, verbose=False)
+
+            started = time.perf_counter()
+            if render_atomically(output_pdf, render):
+                print(f"✅ {output_pdf} opdateret med {len(image_paths)} billeder "
+                      f"({time.perf_counter() - started:.1f}s)")
+            else:
+                print(f"❌ {output_pdf} kunne ikke genereres")
+        watched = folder_path
+
+    # Øjebliksbilledet tages før første generering, så ændringer undervejs også opdages
+    watcher = FolderWatcher(scan, interval=args.interval, debounce=args.debounce)
+    rebuild()
+    print(f"👀 Overvåger {watched} (Ctrl+C for at stoppe)")
+    try:
+        while True:
+            changes = watcher.wait_for_changes()
+            print(f"\n🔄 {len(changes.added)} nye, {len(changes.changed)} ændrede og "
+                  f"{len(changes.removed)} slettede billeder")
+            rebuild()
+    except KeyboardInterrupt:
+        print("\n👋 Overvågning stoppet")
+        return 0
+
+def main(argv=None):
     """Hovedfunktion"""
+    args = parse_args(argv)
+    if args.watch:
+        return watch_main(args)
+    if args.folders or args.root:
+        return batch_main(args)
+
     print("📸 Fotodokumentation Generator - Kommandolinje Version")
     print("="*50)
     
@@ -220,28 +562,32 @@ def main():
         print("   • Tilføj dit logo som 'logo.png' i denne mappe")
         print("   • Opret en 'billeder' mappe med dine billeder")
         print("   • Genkør scriptet")
-        return
+        return 1
     
     # Find billeder
     folder_path = "billeder"
-    image_extensions = ('.jpg', '.jpeg', '.png', '.bmp', '.gif')
     
     try:
-        image_files = [f for f in os.listdir(folder_path) if f.lower().endswith(image_extensions)]
-        if not image_files:
+        image_paths = find_images(folder_path)
+        if not image_paths:
             print(f"❌ Ingen billeder fundet i '{folder_path}' mappe")
-            print(f"💡 Understøttede formater: {', '.join(image_extensions)}")
-            return
+            print(f"💡 Understøttede formater: {', '.join(IMAGE_EXTENSIONS)}")
+            return 1
         
-        print(f"📂 Fundet {len(image_files)} billeder i '{folder_path}' mappe")
+        print(f"📂 Fundet {len(image_paths)} billeder i '{folder_path}' mappe")
         
     except Exception as e:
         print(f"❌ Fejl ved læsning af billedmappe: {e}")
-        return
+        return 1
     
     # Generer PDF
     print("\n🔄 Starter PDF-generering...")
-    output_pdf_path = create_pdf_with_grid_layout(folder_path, output_pdf="photo_documentation.pdf")
+    if args.max_size is not None:
+        output_pdf_path = create_pdf_within_budget(folder_path, "photo_documentation.pdf", args.max_size,
+                                                   image_paths=image_paths)
+    else:
+        output_pdf_path = create_pdf_with_grid_layout(folder_path, output_pdf="photo_documentation.pdf",
+                                                      image_paths=image_paths)
 
     if output_pdf_path:
         print(f"\n🎉 SUCCESS!")
@@ -258,6 +604,8 @@ def main():
     else:
         print("\n❌ PDF-filen blev ikke oprettet.")
         print("🔧 Tjek konsoloutput for fejlmeddelelser")
+        return 1
+    return 0
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file
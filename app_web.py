@@ -4,23 +4,43 @@ Optimized Web Application for Photo Documentation Generator
 Enhanced version with better security, performance, and user experience
 """
 
-from flask import Flask, render_template, request, send_file, jsonify, session
+from flask import Flask, Request, render_template, request, send_file, jsonify, session, Response, g
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import A4
 from reportlab.lib import colors
+from reportlab.lib.utils import simpleSplit
 import os
-import tempfile
+import json
+import math
+import shutil
 import logging
+import tempfile
 import time
 import secrets
 import hashlib
 import mimetypes
 from datetime import datetime, timedelta
-from PIL import Image
+from urllib.parse import quote
 from werkzeug.utils import secure_filename
 from werkzeug.exceptions import RequestEntityTooLarge
 import threading
 import atexit
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait as futures_wait
+from image_pipeline import (iter_prepared_images, image_reader, passthrough_jpeg,
+                            target_pixel_size, BackgroundPreprocessor)
+from derivative_cache import DerivativeCache, file_digest
+from page_chrome import get_logo, stamp_form
+from pdf_jobs import PDFJobQueue, QueueFullError, JOB_DONE
+from pdf_merge import merge_pdfs
+from resource_usage import PeakMemoryTracker
+from upload_ingest import IngestStream, IngestError
+from image_probe import ImageTooLargeError, probe_image, check_decodable
+from size_budget import SizeBudget
+from blob_store import BlobStore, BLOB_DIR_NAME
+from session_store import create_session_store
+from upload_catalog import UploadCatalog, KIND_UPLOAD, KIND_PDF
+from metrics import MetricsRegistry, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from pdf_setup import configure_reportlab
 
 # Configure logging
 logging.basicConfig(
@@ -33,13 +53,68 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+configure_reportlab()
+
+class IngestRequest(Request):
+    """Stream uploaded files straight into the upload folder while hashing them"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None,
+                         content_length=None):
+        stream = IngestStream(app.config['UPLOAD_FOLDER'], max_decode_bytes=MAX_DECODE_BYTES)
+        self._ingest_streams.append(stream)
+        return stream
+
+    @property
+    def _ingest_streams(self):
+        streams = self.__dict__.get('_ingest_stream_list')
+        if streams is None:
+            streams = self.__dict__['_ingest_stream_list'] = []
+        return streams
+
+    def close(self):
+        super().close()
+        # Also removes partial files of uploads aborted while parsing
+        for stream in self._ingest_streams:
+            stream.close()
+
 # Initialize Flask app
 app = Flask(__name__)
-app.secret_key = secrets.token_hex(32)  # More secure
+app.request_class = IngestRequest
+# Set SECRET_KEY so session cookies stay valid across restarts
+app.secret_key = os.environ.get('SECRET_KEY') or secrets.token_hex(32)
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max-limit
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(hours=24)
 
+# Session store settings; use 'sqlite' to keep sessions across restarts. PDF jobs and
+# blob references live in this process, so the app must run as a single process
+SESSION_STORE_BACKEND = 'memory'
+SESSION_DB_PATH = 'sessions.db'
+SESSION_TTL = 24 * 3600  # Seconds without activity before a session expires
+MAX_SESSIONS = 10000  # Least recently used sessions are evicted beyond this
+
+# Catalog of stored files with their metadata and expiry time
+UPLOAD_CATALOG_PATH = 'upload_catalog.db'
+
+# Batch upload settings
+MAX_BATCH_FILES = 50  # Files accepted in a single /upload-batch request
+CLIENT_PRESIZE_ENABLED = True  # Offer browsers to downscale images before upload
+UPLOAD_WORKERS = 4  # Threads validating and storing the files of batch uploads
+
+# PDF job queue settings
+PDF_JOB_WORKERS = 2  # Reports rendered concurrently
+PDF_JOB_QUEUE_SIZE = 8  # Reports waiting for a worker before new requests are rejected
+SSE_KEEPALIVE_INTERVAL = 15  # Seconds between keep-alive comments on event streams
+
+# Metrics exposed in Prometheus text format on /metrics
+METRICS_PREFIX = 'billededokumentation'
+TIMED_ENDPOINTS = ('upload_file', 'upload_batch', 'generate_pdf')  # Request latencies recorded for these
+
+# Download settings; generated PDFs never change, so they are cached until they expire
+DOWNLOAD_OFFLOAD = None  # 'x-sendfile' (Apache, lighttpd) or 'x-accel-redirect' (nginx) lets the proxy send files
+X_ACCEL_REDIRECT_PREFIX = '/protected-downloads/'  # Internal nginx location aliased to the upload folder
+DOWNLOAD_NAME = 'photo_documentation.pdf'
+
 # File cleanup settings
 CLEANUP_INTERVAL = 3600  # 1 hour
 OLD_FILE_THRESHOLD = 7 * 24 * 3600  # 7 days
@@ -55,7 +130,29 @@ ROWS = 2
 LOGO_PATH = "logo.png"
 HEADER_LOGO_WIDTH = 100
 HEADER_LOGO_HEIGHT = 30
+COVER_LOGO_WIDTH = 314
+COVER_LOGO_HEIGHT = 98
+HEADER_FORM_NAME = "PageHeader"  # Form XObject holding the static page header
 JPEG_QUALITY = 85
+IMAGE_DPI = 72  # Resolution of embedded images (72 = one pixel per point)
+PREPROCESS_WORKERS = os.cpu_count() or 1  # Worker processes for image preprocessing
+DECODE_MEMORY_BUDGET = 2048 * 1024 * 1024  # Decoded pixel memory a PDF job's workers may hold at once
+MAX_DECODE_BYTES = DECODE_MEMORY_BUDGET // PREPROCESS_WORKERS  # Budget of a single image decode
+PAGES_PER_PART = 25  # Pages held in memory at once in bounded-memory mode
+BOUNDED_MEMORY_MIN_IMAGES = 200  # Reports this large are rendered in bounded-memory mode
+RENDER_WORKERS = os.cpu_count() or 1  # Processes drawing page ranges of large reports, shared by all jobs
+PARALLEL_RENDER_MIN_IMAGES = 400  # Reports this large draw ranges of PAGES_PER_PART pages in parallel
+# How descriptions appear under the images: 'fields' makes every description an editable
+# form field; 'flat' draws them as static text, which opens and scrolls much faster in
+# viewers; 'mixed' is 'flat' with editable fields for images without a description
+CAPTION_MODES = ('fields', 'flat', 'mixed')
+CAPTION_MODE = 'fields'
+CAPTION_FONT = "Helvetica"
+CAPTION_FONT_SIZE = 10
+CAPTION_MAX_LINES = 3  # Longer static captions are cut off with an ellipsis
+MIN_SIZE_BUDGET = 256 * 1024  # Smallest max_size_mb accepted by /generate-pdf, in bytes
+DERIVATIVE_CACHE_DIR = "derivative_cache"
+DERIVATIVE_CACHE_MAX_BYTES = 512 * 1024 * 1024  # 512MB
 
 # Supported file types with MIME type validation
 ALLOWED_EXTENSIONS = {
@@ -66,8 +163,77 @@ ALLOWED_EXTENSIONS = {
     'bmp': 'image/bmp'
 }
 
-# In-memory session storage for better performance
-session_data = {}
+# Request latencies and per-stage render timings; recording is a lock and an addition
+metrics = MetricsRegistry()
+request_seconds = metrics.histogram(f'{METRICS_PREFIX}_request_duration_seconds',
+                                    'Latency of upload and PDF requests', labels=('endpoint', 'status'))
+render_stage_seconds = metrics.histogram(f'{METRICS_PREFIX}_render_stage_seconds',
+                                         'Time spent per PDF rendering stage', labels=('stage',))
+render_seconds = metrics.histogram(f'{METRICS_PREFIX}_pdf_render_seconds', 'Wall time of PDF renders')
+rendered_images = metrics.counter(f'{METRICS_PREFIX}_pdf_images_total',
+                                  'Images handled by PDF renders', labels=('result',))
+rendered_reports = metrics.counter(f'{METRICS_PREFIX}_pdf_reports_total',
+                                   'PDF renders by outcome', labels=('result',))
+
+def observe_stage(stage, started):
+    """Record the time since `started` for a render stage; returns the current time"""
+    now = time.perf_counter()
+    render_stage_seconds.observe(now - started, stage)
+    return now
+
+def record_stage_timings(timings):
+    """Record the decode, convert, thumbnail and encode timings of a preprocessed image"""
+    for stage, seconds in timings.items():
+        render_stage_seconds.observe(seconds, stage)
+
+def timed_iter(iterable, stage):
+    """Yield from iterable, recording the time spent waiting for each item as `stage`"""
+    iterator = iter(iterable)
+    while True:
+        started = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        observe_stage(stage, started)
+        yield item
+
+# Server-side session data (creation time and uploaded images)
+session_store = create_session_store(SESSION_STORE_BACKEND, SESSION_DB_PATH,
+                                     ttl=SESSION_TTL, max_sessions=MAX_SESSIONS)
+
+# PDF-ready image derivatives, reused across generations of the same images
+derivative_cache = DerivativeCache(DERIVATIVE_CACHE_DIR, DERIVATIVE_CACHE_MAX_BYTES)
+
+upload_catalog = UploadCatalog(UPLOAD_CATALOG_PATH)
+
+# Shared by all batch uploads so concurrent batches cannot multiply threads
+upload_executor = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS, thread_name_prefix='upload')
+
+# Shared by all PDF jobs so concurrent large reports cannot multiply render processes;
+# the processes are only started once a report is drawn in parallel
+render_executor = ProcessPoolExecutor(max_workers=RENDER_WORKERS)
+
+# Uploads are stored once per distinct content; session files link to the blobs
+blob_store = BlobStore(os.path.join(app.config['UPLOAD_FOLDER'], BLOB_DIR_NAME))
+
+# Shared by PDF jobs and background preprocessing so concurrent work cannot multiply
+# preprocessing processes; the processes are started on first use
+preprocess_executor = ProcessPoolExecutor(max_workers=PREPROCESS_WORKERS)
+
+# Derivatives are precomputed right after upload while the user edits descriptions
+background_preprocessor = BackgroundPreprocessor(derivative_cache, workers=PREPROCESS_WORKERS,
+                                                 on_timings=record_stage_timings,
+                                                 max_decode_bytes=MAX_DECODE_BYTES,
+                                                 executor=preprocess_executor)
+
+# PDF generation runs as background jobs so requests return immediately
+pdf_job_queue = PDFJobQueue(workers=PDF_JOB_WORKERS, max_queued=PDF_JOB_QUEUE_SIZE)
+
+metrics.gauge(f'{METRICS_PREFIX}_pdf_jobs_active', 'PDF jobs queued or running',
+              lambda: {(): pdf_job_queue.active_count()})
+metrics.gauge(f'{METRICS_PREFIX}_derivative_cache_bytes', 'Size of the derivative cache',
+              lambda: {(): derivative_cache.stats()['bytes'] or 0})
 
 def is_valid_image_file(file_path):
     """Enhanced file validation with MIME type checking"""
@@ -84,10 +250,11 @@ def is_valid_image_file(file_path):
         if mime_type != ALLOWED_EXTENSIONS[ext]:
             return False, "MIME type mismatch"
         
-        # Additional PIL validation
+        # Header-only check; no pixel data is decoded
         try:
-            with Image.open(file_path) as img:
-                img.verify()  # Verify it's a valid image
+            check_decodable(probe_image(file_path), MAX_DECODE_BYTES)
+        except ImageTooLargeError as e:
+            return False, f"Image too large: {str(e)}"
         except Exception as e:
             return False, f"Invalid image file: {str(e)}"
         
@@ -100,14 +267,55 @@ def allowed_file(filename):
     """Check if file extension is allowed"""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def owns_file(filename, session_id):
+    """Uploads are prefixed with the session id, generated PDFs with documentation_<session id>_"""
+    if not session_id:
+        return False
+    return filename.startswith(f"{session_id}_") or filename.startswith(f"documentation_{session_id}_")
+
+def upload_digest(filename):
+    """Content digest in an upload named <session id>_<digest>_<token>.<ext>, or None"""
+    parts = filename.split('_')
+    if len(parts) == 3 and len(parts[1]) == 64:
+        return parts[1]
+    return None
+
+def stored_path(filepath):
+    """Shared blob behind an uploaded file, so identical uploads are processed once"""
+    digest = upload_digest(os.path.basename(filepath))
+    if digest is not None:
+        blob = blob_store.blob_path(digest)
+        if os.path.exists(blob):
+            return blob
+    return filepath
+
+def remove_upload(filepath):
+    """Remove an uploaded or generated file and its catalog entry, releasing the shared blob of uploads"""
+    filename = os.path.basename(filepath)
+    digest = upload_digest(filename)
+    if digest is None:
+        os.remove(filepath)
+    elif blob_store.release(filepath, digest):
+        background_preprocessor.discard(blob_store.blob_path(digest))
+    upload_catalog.remove(filename)
+
+def get_cover_logo():
+    """Logo decoded once per process at the largest size it is drawn"""
+    return get_logo(LOGO_PATH, COVER_LOGO_WIDTH, COVER_LOGO_HEIGHT)
+
+def draw_header(c):
+    """Static header content, recorded once per document as a form XObject"""
+    logo = get_cover_logo()
+    if logo is not None:
+        c.drawImage(logo, MARGIN_X, PAGE_HEIGHT - MARGIN_Y + 20,
+                   width=HEADER_LOGO_WIDTH, height=HEADER_LOGO_HEIGHT, mask='auto')
+    c.setFont("Helvetica-Bold", 12)
+    c.drawString(MARGIN_X + HEADER_LOGO_WIDTH + 10, PAGE_HEIGHT - MARGIN_Y + 30, "Fotodokumentation")
+
 def add_header(c):
     """Add header with logo to PDF"""
     try:
-        if os.path.exists(LOGO_PATH):
-            c.drawImage(LOGO_PATH, MARGIN_X, PAGE_HEIGHT - MARGIN_Y + 20,
-                       width=HEADER_LOGO_WIDTH, height=HEADER_LOGO_HEIGHT, mask='auto')
-        c.setFont("Helvetica-Bold", 12)
-        c.drawString(MARGIN_X + HEADER_LOGO_WIDTH + 10, PAGE_HEIGHT - MARGIN_Y + 30, "Fotodokumentation")
+        stamp_form(c, HEADER_FORM_NAME, draw_header)
     except Exception as e:
         logger.warning(f"Could not add header: {e}")
 
@@ -120,151 +328,426 @@ def add_footer(c):
     except Exception as e:
         logger.warning(f"Could not add footer: {e}")
 
-def create_pdf_from_uploaded_images(images_data, output_pdf="photo_documentation.pdf"):
+def new_pdf_canvas(path, page_number):
+    """Canvas with the report metadata whose first page is numbered page_number"""
+    c = canvas.Canvas(path, pagesize=A4)
+    c.setTitle("Fotodokumentation")
+    c.setAuthor("Joachim Thirsbro")
+    c._pageNumber = page_number
+    return c
+
+def draw_cover_page(c):
+    """Cover page with logo, title and date; leaves the canvas on the first image page"""
+    logo = get_cover_logo()
+    if logo is not None:
+        c.drawImage(logo, PAGE_WIDTH / 2 - COVER_LOGO_WIDTH / 2, PAGE_HEIGHT / 2,
+                   width=COVER_LOGO_WIDTH, height=COVER_LOGO_HEIGHT, mask='auto')
+    c.setFont("Helvetica-Bold", 24)
+    c.drawCentredString(PAGE_WIDTH / 2, PAGE_HEIGHT / 2 - 150, "Fotodokumentation")
+    c.setFont("Helvetica", 16)
+    c.drawCentredString(PAGE_WIDTH / 2, PAGE_HEIGHT / 2 - 180,
+                       f"Rapport genereret {datetime.now().strftime('%b %Y')}")
+    c.drawCentredString(PAGE_WIDTH / 2, PAGE_HEIGHT / 2 - 210, "Joachim Thirsbro")
+    c.showPage()
+
+def draw_caption(c, x, y, text):
+    """Static description wrapped to the field width, first baseline at y"""
+    width = IMAGE_MAX_WIDTH - 10
+    lines = simpleSplit(text, CAPTION_FONT, CAPTION_FONT_SIZE, width)
+    if len(lines) > CAPTION_MAX_LINES:
+        lines = lines[:CAPTION_MAX_LINES]
+        last = lines[-1]
+        while last and c.stringWidth(last + '…', CAPTION_FONT, CAPTION_FONT_SIZE) > width:
+            last = last[:-1]
+        lines[-1] = last.rstrip() + '…'
+    text_object = c.beginText(x, y)
+    text_object.setFont(CAPTION_FONT, CAPTION_FONT_SIZE, leading=CAPTION_FONT_SIZE * 1.2)
+    for line in lines:
+        text_object.textLine(line)
+    c.drawText(text_object)
+
+def draw_grid_image(c, slot, field_index, prepared, description, observe=observe_stage, caption_mode=CAPTION_MODE):
+    """
+    Draw a prepared image with its comment line and description in grid
+    position `slot` of the current page, as an editable field or static text
+    depending on caption_mode. Fields are named comment_<field_index>, so
+    names stay unique in merged documents.
+    """
+    gap_x = (PAGE_WIDTH - 2 * MARGIN_X - COLUMNS * IMAGE_MAX_WIDTH) / (COLUMNS - 1) if COLUMNS > 1 else 0
+    gap_y = (PAGE_HEIGHT - 2 * MARGIN_Y - ROWS * (IMAGE_MAX_HEIGHT + 30)) / (ROWS - 1) if ROWS > 1 else 0
+    row = slot // COLUMNS % ROWS
+    col = slot % COLUMNS
+    x = MARGIN_X + col * (IMAGE_MAX_WIDTH + gap_x)
+    y = PAGE_HEIGHT - MARGIN_Y - row * (IMAGE_MAX_HEIGHT + 0 + gap_y) - IMAGE_MAX_HEIGHT
+
+    jpeg_data, img_width, img_height = prepared
+    x_adjusted = x + (IMAGE_MAX_WIDTH - img_width) / 2
+    y_adjusted = y + (IMAGE_MAX_HEIGHT - img_height) / 2
+
+    started = time.perf_counter()
+    c.drawImage(image_reader(jpeg_data), x_adjusted, y_adjusted, width=img_width, height=img_height)
+    started = observe('draw_image', started)
+
+    # Add description if provided
+    comment_y_position = y - 15
+    c.setFillColor(colors.black)
+    c.setFont("Helvetica", 10)
+    c.line(x + 10, comment_y_position, x + IMAGE_MAX_WIDTH - 10, comment_y_position)
+
+    if caption_mode != 'fields' and description:
+        draw_caption(c, x + 10, comment_y_position - 13, description)
+        observe('caption', started)
+    elif caption_mode != 'flat':
+        # Add editable text field
+        c.acroForm.textfield(
+            name=f"comment_{field_index}",
+            x=x + 10,
+            y=comment_y_position - 35,
+            width=IMAGE_MAX_WIDTH - 10,
+            height=20,
+            textColor=colors.black,
+            borderColor=colors.gray,
+            fillColor=colors.white,
+            value=description
+        )
+        observe('acroform', started)
+
+def render_page_range(output_path, first_page, images, caption_mode=CAPTION_MODE):
+    """
+    Process pool task: draw images, a list of (field index, prepared result,
+    description), onto consecutive pages numbered from first_page and save
+    them to output_path. Returns the number of images that could not be
+    drawn and the (stage, seconds) observations, for the parent's metrics.
+    """
+    observations = []
+
+    def observe(stage, started):
+        now = time.perf_counter()
+        observations.append((stage, now - started))
+        return now
+
+    c = new_pdf_canvas(output_path, first_page)
+    add_header(c)
+    failed = 0
+    for slot, (field_index, prepared, description) in enumerate(images):
+        if slot != 0 and slot % (COLUMNS * ROWS) == 0:
+            started = time.perf_counter()
+            add_footer(c)
+            c.showPage()
+            add_header(c)
+            observe('page', started)
+        try:
+            draw_grid_image(c, slot, field_index, prepared, description, observe, caption_mode)
+        except Exception as e:
+            # The slot stays empty; moving later images would shift every following range
+            logger.error(f"Error drawing image {field_index}: {e}")
+            failed += 1
+    add_footer(c)
+    started = time.perf_counter()
+    c.save()
+    observe('save', started)
+    return failed, observations
+
+def render_page_ranges(images, prepared_images, parts_dir, first_page, pages_per_range, workers,
+                       progress_callback, caption_mode=CAPTION_MODE):
+    """
+    Render (index, image_info) images with their (result, error) pairs in
+    ranges of pages_per_range pages, drawn concurrently on the shared render
+    pool with up to `workers` ranges of this report at a time. The grid puts
+    COLUMNS * ROWS images on every page, so once an image is known to be
+    usable its page and slot are fixed and ranges can be drawn independently.
+    progress_callback(images_handled, pages_done, images_failed) is called as
+    ranges finish. Returns the part paths in page order and the number of
+    embedded images.
+    """
+    per_range = pages_per_range * COLUMNS * ROWS
+    part_paths = []
+    running = {}  # future -> (images handled, pages, images drawn) of the range
+    handled_done = pages_done = embedded = failed_done = 0
+    max_running = workers * 2  # Ranges waiting for a process hold their prepared images in memory
+
+    def collect(done):
+        nonlocal handled_done, pages_done, embedded, failed_done
+        for future in done:
+            failed, observations = future.result()
+            handled, pages, count = running.pop(future)
+            for stage, seconds in observations:
+                render_stage_seconds.observe(seconds, stage)
+            rendered_images.inc('embedded', amount=count - failed)
+            rendered_images.inc('failed', amount=failed)
+            handled_done += handled
+            pages_done += pages
+            embedded += count - failed
+            failed_done += failed
+            progress_callback(handled_done, pages_done, failed_done)
+
+    try:
+        def submit(chunk, handled):
+            path = os.path.join(parts_dir, f"range_{len(part_paths):05d}.pdf")
+            range_first_page = first_page + len(part_paths) * pages_per_range
+            part_paths.append(path)
+            future = render_executor.submit(render_page_range, path, range_first_page, chunk, caption_mode)
+            running[future] = (handled, max(1, -(-len(chunk) // (COLUMNS * ROWS))), len(chunk))
+            if len(running) >= max_running:
+                started = time.perf_counter()
+                collect(futures_wait(running, return_when=FIRST_COMPLETED).done)
+                observe_stage('range_wait', started)
+
+        chunk, handled = [], 0
+        for (i, image_info), (prepared, error) in zip(images, prepared_images):
+            handled += 1
+            if error is not None:
+                logger.error(f"Error processing image {image_info['path']}: {error}")
+                rendered_images.inc('failed')
+                failed_done += 1
+                continue
+            chunk.append((i, prepared, image_info.get('description', '')))
+            if len(chunk) == per_range:
+                submit(chunk, handled)
+                chunk, handled = [], 0
+        # An empty report still gets its first page
+        if chunk or not part_paths:
+            submit(chunk, handled)
+        else:
+            handled_done += handled
+
+        started = time.perf_counter()
+        collect(futures_wait(running).done)
+        observe_stage('range_wait', started)
+    finally:
+        # The pool outlives this report; drop its ranges that have not started
+        for future in running:
+            future.cancel()
+    return part_paths, embedded
+
+def create_pdf_from_uploaded_images(images_data, output_pdf="photo_documentation.pdf", workers=PREPROCESS_WORKERS,
+                                    progress_callback=None, pages_per_part=None, prepared_hook=None,
+                                    render_workers=None, caption_mode=CAPTION_MODE):
     """
-    Enhanced PDF generation with better error handling and performance
+    Enhanced PDF generation with better error handling and performance.
+    Images are preprocessed in parallel on the shared preprocessing pool
+    while the canvas is assembled sequentially in the original order;
+    `workers` sizes how many images this report keeps queued on the pool.
+    progress_callback(images_handled, page_number, images_failed) is called
+    after each image; images_failed counts the images left out of the PDF
+    because they are invalid or could not be decoded.
+
+    With pages_per_part set, memory stays flat regardless of report size:
+    every batch of pages is saved to a part file as soon as it is complete,
+    and the parts are stream-merged into output_pdf at the end.
+
+    With render_workers set, batches of pages_per_part pages (PAGES_PER_PART
+    by default) are instead drawn in parallel on the shared render pool, up
+    to render_workers batches at a time, see render_page_ranges.
+
+    prepared_hook(source_paths, prepared_images), if given, returns the
+    (result, error) pairs to draw instead of the preprocessed images.
+    caption_mode is one of CAPTION_MODES.
     """
     if not images_data:
         logger.warning("No images provided for PDF generation")
         return None
 
+    parts_dir = None
+    render_started = time.perf_counter()
     try:
-        c = canvas.Canvas(output_pdf, pagesize=A4)
-        c.setTitle("Fotodokumentation")
-        c.setAuthor("Joachim Thirsbro")
-        c._pageNumber = 1
+        memory = PeakMemoryTracker()
+        part_paths = []
+        if render_workers and not pages_per_part:
+            pages_per_part = PAGES_PER_PART
+        if pages_per_part:
+            parts_dir = tempfile.mkdtemp(prefix='.parts_', dir=os.path.dirname(os.path.abspath(output_pdf)))
+
+        def open_canvas(page_number):
+            if parts_dir is None:
+                path = output_pdf
+            else:
+                path = os.path.join(parts_dir, f"part_{len(part_paths):05d}.pdf")
+            part_paths.append(path)
+            return new_pdf_canvas(path, page_number)
+
+        c = open_canvas(1)
+        part_first_page = 1
 
         # Create cover page
-        if os.path.exists(LOGO_PATH):
-            c.drawImage(LOGO_PATH, PAGE_WIDTH / 2 - 314 / 2, PAGE_HEIGHT / 2,
-                       width=314, height=98, mask='auto')
-        c.setFont("Helvetica-Bold", 24)
-        c.drawCentredString(PAGE_WIDTH / 2, PAGE_HEIGHT / 2 - 150, "Fotodokumentation")
-        c.setFont("Helvetica", 16)
-        c.drawCentredString(PAGE_WIDTH / 2, PAGE_HEIGHT / 2 - 180,
-                           f"Rapport genereret {datetime.now().strftime('%b %Y')}")
-        c.drawCentredString(PAGE_WIDTH / 2, PAGE_HEIGHT / 2 - 210, "Joachim Thirsbro")
-
-        c.showPage()
-        add_header(c)
-
-        # Calculate layout
-        gap_x = (PAGE_WIDTH - 2 * MARGIN_X - COLUMNS * IMAGE_MAX_WIDTH) / (COLUMNS - 1) if COLUMNS > 1 else 0
-        gap_y = (PAGE_HEIGHT - 2 * MARGIN_Y - ROWS * (IMAGE_MAX_HEIGHT + 30)) / (ROWS - 1) if ROWS > 1 else 0
-
-        image_counter = 0
-        processed_images = 0
-        
+        started = time.perf_counter()
+        draw_cover_page(c)
+        if render_workers:
+            # Image pages are drawn by the pool into parts of their own
+            c.save()
+        else:
+            add_header(c)
+        observe_stage('cover', started)
+
+        # Validate up front so only usable images are sent to the worker pool
+        valid_images = []
         for i, image_info in enumerate(images_data):
             image_path = image_info['path']
-            description = image_info.get('description', '')
-
-            # Calculate position
-            row = image_counter // COLUMNS % ROWS
-            col = image_counter % COLUMNS
-
-            # New page when needed
-            if image_counter != 0 and image_counter % (COLUMNS * ROWS) == 0:
-                add_footer(c)
-                c.showPage()
-                add_header(c)
-                row = 0
-
-            x = MARGIN_X + col * (IMAGE_MAX_WIDTH + gap_x)
-            y = PAGE_HEIGHT - MARGIN_Y - row * (IMAGE_MAX_HEIGHT + 0 + gap_y) - IMAGE_MAX_HEIGHT
-
-            try:
-                # Enhanced image processing with better error handling
+            # Catalogued uploads were validated when they were stored
+            if not image_info.get('validated'):
                 is_valid, validation_msg = is_valid_image_file(image_path)
                 if not is_valid:
                     logger.warning(f"Skipping invalid image {image_path}: {validation_msg}")
                     continue
+            valid_images.append((i, image_info))
+
+        images_skipped = len(images_data) - len(valid_images)
+        images_failed = images_skipped
+
+        def report_progress(images_handled, page_number=None):
+            if progress_callback is not None:
+                progress_callback(images_handled, page_number or c.getPageNumber(), images_failed)
+
+        rendered_images.inc('skipped', amount=images_skipped)
+        report_progress(images_skipped)
+
+        # Pick up derivatives still being computed since upload
+        source_paths = [stored_path(image_info['path']) for _, image_info in valid_images]
+        started = time.perf_counter()
+        background_preprocessor.wait(source_paths)
+        observe_stage('background_wait', started)
+
+        # Time blocked on preprocessing shows up as the 'wait' stage
+        prepared_images = timed_iter(iter_prepared_images(
+            source_paths,
+            IMAGE_MAX_WIDTH, IMAGE_MAX_HEIGHT, JPEG_QUALITY, dpi=IMAGE_DPI, workers=workers,
+            cache=derivative_cache, on_timings=record_stage_timings,
+            max_decode_bytes=DECODE_MEMORY_BUDGET // max(1, workers), executor=preprocess_executor
+        ), 'wait')
+        if prepared_hook is not None:
+            prepared_images = prepared_hook(source_paths, prepared_images)
+
+        if render_workers:
+            def report_range_progress(handled, pages, failed):
+                nonlocal images_failed
+                images_failed = images_skipped + failed
+                memory.sample()
+                report_progress(images_skipped + handled, 1 + pages)
+
+            range_paths, processed_images = render_page_ranges(
+                valid_images, prepared_images, parts_dir, 2, pages_per_part, render_workers,
+                report_range_progress, caption_mode)
+            part_paths.extend(range_paths)
+        else:
+            image_counter = 0
+            processed_images = 0
+
+            for handled, ((i, image_info), (prepared, error)) in enumerate(zip(valid_images, prepared_images), 1):
+                # New page when needed
+                if image_counter != 0 and image_counter % (COLUMNS * ROWS) == 0:
+                    started = time.perf_counter()
+                    add_footer(c)
+                    memory.sample()
+                    if parts_dir is not None and c.getPageNumber() - part_first_page + 1 >= pages_per_part:
+                        # Flush the finished batch of pages to disk and continue in a new part
+                        part_first_page = c.getPageNumber() + 1
+                        c.showPage()
+                        started = observe_stage('page', started)
+                        c.save()
+                        started = observe_stage('save', started)
+                        c = open_canvas(part_first_page)
+                    else:
+                        c.showPage()
+                    add_header(c)
+                    observe_stage('page', started)
+
+                try:
+                    if error is not None:
+                        raise error
+                    draw_grid_image(c, image_counter, i, prepared, image_info.get('description', ''),
+                                    caption_mode=caption_mode)
+                    processed_images += 1
+                    rendered_images.inc('embedded')
+
+                except Exception as e:
+                    logger.error(f"Error processing image {image_info['path']}: {e}")
+                    rendered_images.inc('failed')
+                    images_failed += 1
+                    report_progress(images_skipped + handled)
+                    continue
 
-                with Image.open(image_path) as img:
-                    # Convert to RGB if necessary
-                    if img.mode in ('RGBA', 'LA', 'P'):
-                        # Create white background for transparency
-                        background = Image.new('RGB', img.size, (255, 255, 255))
-                        if img.mode == 'P':
-                            img = img.convert('RGBA')
-                        background.paste(img, mask=img.split()[-1] if img.mode in ('RGBA', 'LA') else None)
-                        img = background
-                    elif img.mode != 'RGB':
-                        img = img.convert('RGB')
-                    
-                    img.thumbnail((IMAGE_MAX_WIDTH, IMAGE_MAX_HEIGHT))
-                    img_width, img_height = img.size
-
-                    x_adjusted = x + (IMAGE_MAX_WIDTH - img_width) / 2
-                    y_adjusted = y + (IMAGE_MAX_HEIGHT - img_height) / 2
-
-                    # Optimize image processing
-                    with tempfile.NamedTemporaryFile(suffix=".jpg", delete=False) as tmp_file:
-                        temp_image_path = tmp_file.name
-                        img.save(temp_image_path, format="JPEG", quality=JPEG_QUALITY, optimize=True)
-
-                c.drawImage(temp_image_path, x_adjusted, y_adjusted, width=img_width, height=img_height)
-                os.remove(temp_image_path)
-                processed_images += 1
-                
-            except Exception as e:
-                logger.error(f"Error processing image {image_path}: {e}")
-                continue
-
-            # Add description if provided
-            comment_y_position = y - 15
-            c.setFillColor(colors.black)
-            c.setFont("Helvetica", 10)
-            c.line(x + 10, comment_y_position, x + IMAGE_MAX_WIDTH - 10, comment_y_position)
-
-            # Add editable text field
-            c.acroForm.textfield(
-                name=f"comment_{i}",
-                x=x + 10,
-                y=comment_y_position - 35,
-                width=IMAGE_MAX_WIDTH - 10,
-                height=20,
-                textColor=colors.black,
-                borderColor=colors.gray,
-                fillColor=colors.white,
-                value=description
-            )
+                image_counter += 1
+                report_progress(images_skipped + handled)
 
-            image_counter += 1
+            add_footer(c)
+            started = time.perf_counter()
+            c.save()
+            observe_stage('save', started)
+        memory.sample()
 
-        add_footer(c)
-        c.save()
+        if parts_dir is not None:
+            started = time.perf_counter()
+            merge_pdfs(part_paths, output_pdf)
+            observe_stage('merge', started)
+            memory.sample()
         
         logger.info(f"PDF generated successfully: {output_pdf} with {processed_images} images")
+        logger.info(f"Peak memory during rendering: {memory.format_peak()} ({len(part_paths)} part(s))")
+        cache_stats = derivative_cache.stats()
+        logger.info(f"Derivative cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses")
+        render_seconds.observe(time.perf_counter() - render_started)
+        rendered_reports.inc('done')
         return output_pdf
 
     except Exception as e:
         logger.error(f"Error generating PDF: {e}")
+        rendered_reports.inc('failed')
         return None
+    finally:
+        if parts_dir is not None:
+            shutil.rmtree(parts_dir, ignore_errors=True)
+
+def create_pdf_within_budget(images_data, output_pdf, size_budget, progress_callback=None, **options):
+    """
+    create_pdf_from_uploaded_images, with images re-encoded at lower quality
+    or resolution until the PDF is at most size_budget bytes
+    """
+    budget = SizeBudget(size_budget, IMAGE_MAX_WIDTH, IMAGE_MAX_HEIGHT, IMAGE_DPI, MAX_DECODE_BYTES)
+    # Progress is reported while the first pass draws the pages
+    return budget.render(
+        lambda prepared_hook, first_pass: create_pdf_from_uploaded_images(
+            images_data, output_pdf, progress_callback=progress_callback if first_pass else None,
+            prepared_hook=prepared_hook, **options),
+        output_pdf)
 
 def cleanup_old_files():
-    """Background cleanup of old uploaded files"""
+    """Background cleanup of expired uploads and PDFs, found through the catalog's expiry index"""
     try:
-        current_time = time.time()
         cleaned_count = 0
-        
-        for filename in os.listdir(app.config['UPLOAD_FOLDER']):
+
+        for filename in upload_catalog.expired():
             filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            if os.path.isfile(filepath):
-                file_age = current_time - os.stat(filepath).st_mtime
-                if file_age > OLD_FILE_THRESHOLD:
-                    try:
-                        os.remove(filepath)
-                        cleaned_count += 1
-                    except Exception as e:
-                        logger.warning(f"Could not remove old file {filepath}: {e}")
-        
+            try:
+                remove_upload(filepath)
+                cleaned_count += 1
+            except FileNotFoundError:
+                upload_catalog.remove(filename)
+            except Exception as e:
+                logger.warning(f"Could not remove old file {filepath}: {e}")
+
         if cleaned_count > 0:
             logger.info(f"Cleaned up {cleaned_count} old files")
-            
+
+        expired_sessions = session_store.purge_expired()
+        if expired_sessions:
+            logger.info(f"Removed {expired_sessions} expired sessions")
+
     except Exception as e:
         logger.error(f"Error during cleanup: {e}")
 
+def catalog_kind(filename):
+    """Catalog kind and owner session of a file in the upload folder, judged by its name"""
+    if filename.startswith('documentation_'):
+        return KIND_PDF, filename.split('_')[1]
+    return KIND_UPLOAD, filename.split('_')[0]
+
+def catalog_untracked_files():
+    """Add files from before the catalog existed, and drop blobs nothing links to"""
+    added = upload_catalog.add_untracked(app.config['UPLOAD_FOLDER'], catalog_kind, OLD_FILE_THRESHOLD)
+    if added:
+        logger.info(f"Added {added} existing files to the upload catalog")
+    blob_store.sweep()
+
 def start_cleanup_task():
     """Start the background cleanup task"""
     def cleanup_worker():
@@ -276,7 +759,44 @@ def start_cleanup_task():
     cleanup_thread.start()
     logger.info("Background cleanup task started")
 
+background_tasks_lock = threading.Lock()
+background_tasks_started = False
+
+def start_background_tasks():
+    """Catalog files left from earlier versions and start the cleanup task, once per process"""
+    global background_tasks_started
+    with background_tasks_lock:
+        if background_tasks_started:
+            return
+        background_tasks_started = True
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    catalog_untracked_files()
+    start_cleanup_task()
+
 # Routes
+@app.before_request
+def ensure_background_tasks():
+    # WSGI servers import the app without running __main__; start with the first request
+    if not background_tasks_started:
+        start_background_tasks()
+
+@app.before_request
+def start_request_timer():
+    if request.endpoint in TIMED_ENDPOINTS:
+        g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_latency(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        request_seconds.observe(time.perf_counter() - started, request.endpoint, str(response.status_code))
+    return response
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Request latencies and render stage timings in Prometheus text format"""
+    return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
 @app.route('/')
 def index():
     """Main page with upload interface"""
@@ -287,17 +807,114 @@ def index():
             session['created_at'] = datetime.now().isoformat()
         
         # Initialize session data
-        if session['session_id'] not in session_data:
-            session_data[session['session_id']] = {
-                'created_at': datetime.now(),
-                'images': []
-            }
+        session_store.ensure(session['session_id'])
         
         return render_template('index.html')
     except Exception as e:
         logger.error(f"Error rendering index: {e}")
         return "Server fejl", 500
 
+def is_presized(ingested):
+    """True if an upload can be embedded as-is: a JPEG no larger than the derivative size"""
+    max_width, max_height = target_pixel_size(IMAGE_MAX_WIDTH, IMAGE_MAX_HEIGHT, IMAGE_DPI)
+    return (ingested.format == 'JPEG' and ingested.mode in ('RGB', 'L')
+            and ingested.width <= max_width and ingested.height <= max_height)
+
+def store_upload(file, session_id, presized=False):
+    """
+    Validate an uploaded file and link it into the session's files.
+    Files the browser marks as presized are used as their own derivative
+    when they really are small enough. Returns (result, status); the result
+    is the per-file JSON response.
+    """
+    if file.filename == '':
+        return {'error': 'Ingen fil valgt'}, 400
+
+    # Enhanced file validation
+    if not allowed_file(file.filename):
+        return {'error': 'Ikke tilladt filtype', 'original_name': file.filename}, 400
+
+    # Create secure filename
+    original_filename = secure_filename(file.filename)
+    if not original_filename:
+        return {'error': 'Ugyldigt filnavn', 'original_name': file.filename}, 400
+
+    # The upload was hashed and its header read while it streamed to disk
+    try:
+        ingested = file.stream.inspect()
+    except IngestError as e:
+        return {'error': f'Ugyldigt billede: {e}', 'original_name': original_filename}, 400
+
+    file_extension = original_filename.rsplit('.', 1)[1].lower()
+    if ingested.mime_type != ALLOWED_EXTENSIONS[file_extension]:
+        return {'error': 'Ugyldigt billede: MIME type mismatch', 'original_name': original_filename}, 400
+
+    # Create unique filename with session ID
+    unique_filename = f"{session_id}_{ingested.digest}_{secrets.token_hex(4)}.{file_extension}"
+    filepath = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
+
+    # Identical content is stored once and linked into the session
+    file.stream.flush()
+    is_new_content = blob_store.store(file.stream.path, ingested.digest, filepath)
+    upload_catalog.add_upload(unique_filename, session_id, ingested, time.time() + OLD_FILE_THRESHOLD)
+
+    # Start preparing the PDF rendition while the user keeps working
+    presized = presized and is_presized(ingested)
+    try:
+        blob_path = blob_store.blob_path(ingested.digest)
+        derivative_cache.remember_digest(blob_path, ingested.digest)
+        if presized:
+            key = derivative_cache.key(ingested.digest, IMAGE_MAX_WIDTH, IMAGE_MAX_HEIGHT,
+                                       JPEG_QUALITY, IMAGE_DPI)
+            if not derivative_cache.contains(key):
+                derivative_cache.put(key, passthrough_jpeg(blob_path, dpi=IMAGE_DPI))
+        else:
+            background_preprocessor.submit(blob_path, IMAGE_MAX_WIDTH, IMAGE_MAX_HEIGHT,
+                                           JPEG_QUALITY, dpi=IMAGE_DPI)
+    except Exception as e:
+        logger.warning(f"Could not queue preprocessing for {unique_filename}: {e}")
+
+    logger.info(f"File uploaded: {original_filename} -> {unique_filename}"
+                f"{'' if is_new_content else ' (duplicate content)'}")
+
+    return {
+        'success': True,
+        'filename': unique_filename,
+        'original_name': original_filename,
+        'file_size': ingested.size,
+        'width': ingested.width,
+        'height': ingested.height,
+        'presized': presized
+    }, 200
+
+def add_to_session(session_id, result):
+    """Record a stored upload in the session data"""
+    # The session may have expired from the store while the page stayed open
+    session_store.ensure(session_id)
+    session_store.add_image(session_id, {
+        'filename': result['filename'],
+        'original_name': result['original_name'],
+        'upload_time': datetime.now().isoformat(),
+        'width': result['width'],
+        'height': result['height'],
+        'presized': result['presized']
+    })
+
+@app.route('/config')
+def client_config():
+    """Upload limits and the image size the PDF needs, for the browser"""
+    max_width, max_height = target_pixel_size(IMAGE_MAX_WIDTH, IMAGE_MAX_HEIGHT, IMAGE_DPI)
+    return jsonify({
+        'max_request_bytes': app.config['MAX_CONTENT_LENGTH'],
+        'max_batch_files': MAX_BATCH_FILES,
+        'presize': {
+            'enabled': CLIENT_PRESIZE_ENABLED,
+            'max_width': max_width,
+            'max_height': max_height,
+            'quality': JPEG_QUALITY
+        }
+    })
+
 @app.route('/upload', methods=['POST'])
 def upload_file():
     """Enhanced file upload with better validation"""
@@ -306,62 +923,60 @@ def upload_file():
         if 'file' not in request.files:
             return jsonify({'error': 'Ingen fil uploaded'}), 400
 
-        file = request.files['file']
-        if file.filename == '':
-            return jsonify({'error': 'Ingen fil valgt'}), 400
-
-        # Enhanced file validation
-        if not allowed_file(file.filename):
-            return jsonify({'error': 'Ikke tilladt filtype'}), 400
+        session_id = session.get('session_id', 'unknown')
+        presized = request.form.get('presized') == '1'
+        result, status = store_upload(request.files['file'], session_id, presized)
+        if status == 200:
+            add_to_session(session_id, result)
+        else:
+            result.pop('original_name', None)
+        return jsonify(result), status
 
-        # Additional security checks
-        if not file.filename:
-            return jsonify({'error': 'Ugyldigt filnavn'}), 400
+    except RequestEntityTooLarge:
+        return jsonify({'error': 'Filen er for stor (Max 16MB)'}), 413
+    except Exception as e:
+        logger.error(f"Upload error: {e}")
+        return jsonify({'error': f'Upload fejl: {str(e)}'}), 500
 
-        # Create secure filename
-        original_filename = secure_filename(file.filename)
-        if not original_filename:
-            return jsonify({'error': 'Ugyldigt filnavn'}), 400
+@app.route('/upload-batch', methods=['POST'])
+def upload_batch():
+    """Upload several files in one request; returns a result per file in request order"""
+    try:
+        files = request.files.getlist('files')
+        if not files:
+            return jsonify({'error': 'Ingen filer uploaded'}), 400
+        if len(files) > MAX_BATCH_FILES:
+            return jsonify({'error': f'For mange filer i én upload (max {MAX_BATCH_FILES})'}), 400
 
-        # Create unique filename with session ID
         session_id = session.get('session_id', 'unknown')
-        file_hash = hashlib.md5(file.read()).hexdigest()[:8]
-        file.seek(0)  # Reset file pointer
-        
-        file_extension = original_filename.rsplit('.', 1)[1].lower()
-        unique_filename = f"{session_id}_{file_hash}_{secrets.token_hex(4)}.{file_extension}"
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-        
-        # Save file
-        file.save(filepath)
+        # Optional presized flag per file, in the same order as the files
+        presized_flags = request.form.getlist('presized')
+        presized_flags += ['0'] * (len(files) - len(presized_flags))
 
-        # Validate saved file
-        is_valid, validation_msg = is_valid_image_file(filepath)
-        if not is_valid:
-            os.remove(filepath)  # Remove invalid file
-            return jsonify({'error': f'Ugyldigt billede: {validation_msg}'}), 400
-
-        # Add to session data
-        if session_id in session_data:
-            session_data[session_id]['images'].append({
-                'filename': unique_filename,
-                'original_name': original_filename,
-                'upload_time': datetime.now()
-            })
+        def store(file, presized_flag):
+            try:
+                return store_upload(file, session_id, presized_flag == '1')
+            except Exception as e:
+                logger.error(f"Upload error for {file.filename}: {e}")
+                return {'error': f'Upload fejl: {str(e)}', 'original_name': file.filename}, 500
+
+        # Files are validated and linked concurrently; results keep the request order
+        results = []
+        for result, status in upload_executor.map(store, files, presized_flags):
+            if status == 200:
+                add_to_session(session_id, result)
+            else:
+                result['success'] = False
+            results.append(result)
 
-        logger.info(f"File uploaded: {original_filename} -> {unique_filename}")
-
-        return jsonify({
-            'success': True,
-            'filename': unique_filename,
-            'original_name': original_filename,
-            'file_size': os.path.getsize(filepath)
-        })
+        uploaded = sum(1 for result in results if result['success'])
+        logger.info(f"Batch upload: {uploaded}/{len(results)} files stored")
+        return jsonify({'success': True, 'uploaded': uploaded, 'results': results})
 
     except RequestEntityTooLarge:
-        return jsonify({'error': 'Filen er for stor (Max 16MB)'}), 413
+        return jsonify({'error': 'Upload er for stor (Max 16MB pr. request)'}), 413
     except Exception as e:
-        logger.error(f"Upload error: {e}")
+        logger.error(f"Batch upload error: {e}")
         return jsonify({'error': f'Upload fejl: {str(e)}'}), 500
 
 @app.route('/generate-pdf', methods=['POST'])
@@ -376,7 +991,29 @@ def generate_pdf():
         if not images:
             return jsonify({'error': 'Ingen billeder at generere PDF fra'}), 400
 
-        # Prepare image data
+        session_id = session.get('session_id', 'unknown')
+
+        # Optional size budget, e.g. for mail servers that cap attachments
+        size_budget = None
+        if data.get('max_size_mb') is not None:
+            try:
+                max_size_mb = float(data['max_size_mb'])
+            except (TypeError, ValueError):
+                max_size_mb = math.nan
+            # Infinity would overflow the conversion to bytes, and NaN compares false to everything
+            if not math.isfinite(max_size_mb) or max_size_mb <= 0:
+                return jsonify({'error': 'Ugyldig maksimal PDF-størrelse'}), 400
+            size_budget = int(max_size_mb * 1024 * 1024)
+            if size_budget < MIN_SIZE_BUDGET:
+                minimum = f'{MIN_SIZE_BUDGET / 1024 / 1024:g}'.replace('.', ',')
+                return jsonify({'error': f'Maksimal PDF-størrelse skal være mindst {minimum} MB'}), 400
+
+        caption_mode = data.get('caption_mode') or CAPTION_MODE
+        if caption_mode not in CAPTION_MODES:
+            return jsonify({'error': 'Ugyldig visning af beskrivelser'}), 400
+
+        # Prepare image data; catalogued files need no existence check or revalidation
+        catalog_entries = upload_catalog.get_many(img.get('filename') for img in images if img.get('filename'))
         images_data = []
         for img in images:
             filename = img.get('filename')
@@ -384,7 +1021,18 @@ def generate_pdf():
                 continue
                 
             filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            if os.path.exists(filepath):
+            entry = catalog_entries.get(filename)
+            if entry is not None:
+                if entry['session_id'] != session_id:
+                    logger.warning(f"Skipping image from another session: {filename}")
+                    continue
+                images_data.append({
+                    'path': filepath,
+                    'description': img.get('description', ''),
+                    'validated': bool(entry['validated']),
+                    'digest': entry['digest']
+                })
+            elif os.path.exists(filepath):
                 images_data.append({
                     'path': filepath,
                     'description': img.get('description', '')
@@ -395,34 +1043,159 @@ def generate_pdf():
         if not images_data:
             return jsonify({'error': 'Ingen gyldige billeder fundet'}), 400
 
+        # Identical input gives an identical PDF; reuse one generated earlier
+        manifest_digest = pdf_manifest_digest(session_id, images_data, size_budget, caption_mode)
+        existing = find_memoized_pdf(manifest_digest, size_budget)
+        if existing is not None:
+            logger.info(f"Reusing generated PDF {existing['download_url']}")
+            return jsonify({'success': True, 'status': JOB_DONE, 'cached': True, **existing})
+
         # Generate unique PDF filename
-        session_id = session.get('session_id', 'unknown')
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        output_filename = f"documentation_{session_id}_{timestamp}.pdf"
+        output_filename = f"documentation_{session_id}_{timestamp}_{secrets.token_hex(4)}.pdf"
         output_path = os.path.join(app.config['UPLOAD_FOLDER'], output_filename)
 
-        # Generate PDF
-        logger.info(f"Starting PDF generation for {len(images_data)} images")
-        result = create_pdf_from_uploaded_images(images_data, output_path)
+        def render(job):
+            # An identical job may have finished while this one was queued
+            existing = find_memoized_pdf(manifest_digest, size_budget)
+            if existing is not None:
+                return existing
+
+            bounded_memory = len(images_data) >= BOUNDED_MEMORY_MIN_IMAGES
+            parallel = RENDER_WORKERS > 1 and len(images_data) >= PARALLEL_RENDER_MIN_IMAGES
+            options = {'progress_callback': job.report_progress,
+                       'pages_per_part': PAGES_PER_PART if bounded_memory else None,
+                       'render_workers': RENDER_WORKERS if parallel else None,
+                       'caption_mode': caption_mode}
+            if size_budget is None:
+                result = create_pdf_from_uploaded_images(images_data, output_path, **options)
+            else:
+                result = create_pdf_within_budget(images_data, output_path, size_budget, **options)
+            if not result or not os.path.exists(result):
+                logger.error("PDF generation failed")
+                return None
 
-        if result and os.path.exists(result):
-            # Clean up the generated PDF after download
-            download_url = f'/download/{output_filename}'
-            
             logger.info(f"PDF generated successfully: {output_filename}")
-            return jsonify({
-                'success': True,
-                'download_url': download_url,
-                'file_size': os.path.getsize(result)
-            })
-        else:
-            logger.error("PDF generation failed")
-            return jsonify({'error': 'Kunne ikke generere PDF'}), 500
+            file_size = os.path.getsize(result)
+            # The content digest is the download's ETag
+            upload_catalog.add_file(output_filename, KIND_PDF, session_id,
+                                    time.time() + OLD_FILE_THRESHOLD, size=file_size,
+                                    manifest_digest=manifest_digest, digest=file_digest(result))
+            return pdf_job_result(output_filename, file_size, size_budget)
+
+        # Queue PDF generation
+        try:
+            # Concurrent identical requests share one job
+            job = pdf_job_queue.submit(session_id, len(images_data), render, key=manifest_digest)
+        except QueueFullError as e:
+            logger.warning(f"PDF job rejected: {e}")
+            return jsonify({'error': 'Serveren er optaget, prøv igen om lidt'}), 503
+
+        logger.info(f"Queued PDF job {job.id} for {len(images_data)} images")
+        return jsonify({
+            'success': True,
+            'job_id': job.id,
+            'status_url': f'/pdf-jobs/{job.id}',
+            'events_url': f'/pdf-jobs/{job.id}/events'
+        }), 202
 
     except Exception as e:
         logger.error(f"PDF generation error: {e}")
         return jsonify({'error': f'PDF generering fejl: {str(e)}'}), 500
 
+def pdf_manifest_digest(session_id, images_data, size_budget=None, caption_mode=CAPTION_MODE):
+    """
+    Digest of everything that determines a generated PDF: owner, images,
+    descriptions, layout, caption mode and size budget
+    """
+    images = []
+    for image_info in images_data:
+        source = image_info.get('digest')
+        if source is None:
+            # Files from before the catalog: identify by path, size and mtime
+            st = os.stat(image_info['path'])
+            source = f"{image_info['path']}|{st.st_size}|{st.st_mtime_ns}"
+        images.append([source, image_info['description']])
+
+    try:
+        logo_mtime = os.stat(LOGO_PATH).st_mtime_ns
+    except FileNotFoundError:
+        logo_mtime = None
+    layout = [PAGE_WIDTH, PAGE_HEIGHT, IMAGE_MAX_WIDTH, IMAGE_MAX_HEIGHT, MARGIN_X, MARGIN_Y,
+              COLUMNS, ROWS, JPEG_QUALITY, IMAGE_DPI, logo_mtime]
+    # The cover page shows the month the report was generated
+    manifest = [session_id, datetime.now().strftime('%b %Y'), layout, caption_mode, size_budget, images]
+    return hashlib.sha256(json.dumps(manifest).encode('utf-8')).hexdigest()
+
+def pdf_job_result(filename, file_size, size_budget=None):
+    """Job result for a generated PDF; with a size budget, also whether the PDF met it"""
+    result = {
+        'download_url': f'/download/{filename}',
+        'file_size': file_size
+    }
+    if size_budget is not None:
+        # Images that cannot shrink further still give a PDF, just an oversized one
+        result['max_size'] = size_budget
+        result['within_budget'] = file_size <= size_budget
+    return result
+
+def find_memoized_pdf(manifest_digest, size_budget=None):
+    """Job result for a PDF already generated from the same manifest, or None"""
+    for filename in upload_catalog.find_by_manifest(manifest_digest):
+        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        try:
+            file_size = os.path.getsize(filepath)
+        except OSError:
+            continue
+        return pdf_job_result(filename, file_size, size_budget)
+    return None
+
+def pdf_job_status(job):
+    """JSON status of a PDF job, including the download link once finished"""
+    status = job.to_dict()
+    if job.status == JOB_DONE:
+        status.update(job.result)
+    return status
+
+def get_own_pdf_job(job_id):
+    """Look up a job belonging to the current session"""
+    job = pdf_job_queue.get(job_id)
+    if job is None or job.owner != session.get('session_id'):
+        return None
+    return job
+
+@app.route('/pdf-jobs/<job_id>')
+def pdf_job(job_id):
+    """Current status of a PDF generation job"""
+    job = get_own_pdf_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Job ikke fundet'}), 404
+    return jsonify(pdf_job_status(job))
+
+@app.route('/pdf-jobs/<job_id>/events')
+def pdf_job_events(job_id):
+    """Server-Sent Events stream with progress until the job finishes"""
+    job = get_own_pdf_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Job ikke fundet'}), 404
+
+    def stream():
+        last_version = None
+        while True:
+            version = job.wait_for_change(last_version, timeout=SSE_KEEPALIVE_INTERVAL)
+            if version == last_version:
+                yield ": keep-alive\n\n"
+                continue
+            last_version = version
+            yield f"data: {json.dumps(pdf_job_status(job))}\n\n"
+            if job.finished:
+                return
+
+    return Response(stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # Disable proxy buffering of the stream
+    })
+
 @app.route('/download/<filename>')
 def download_file(filename):
     """Enhanced file download with security checks"""
@@ -431,7 +1204,7 @@ def download_file(filename):
         
         # Security check: only allow downloads from own session
         session_id = session.get('session_id', '')
-        if not filename.startswith(session_id):
+        if not owns_file(filename, session_id):
             logger.warning(f"Unauthorized download attempt: {filename} from session {session_id}")
             return "Uautoriseret adgang", 403
 
@@ -443,26 +1216,61 @@ def download_file(filename):
             logger.warning(f"Invalid file path: {filename}")
             return "Ugyldig fil", 400
 
-        # Set appropriate headers
-        response = send_file(
-            filepath, 
-            as_attachment=True, 
-            download_name='photo_documentation.pdf',
-            mimetype='application/pdf'
-        )
-        
-        # Add security headers
-        response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
-        response.headers['Pragma'] = 'no-cache'
-        response.headers['Expires'] = '0'
-        
-        logger.info(f"File downloaded: {filename}")
+        entry = upload_catalog.get_many([filename]).get(filename)
+        etag = download_etag(filename, filepath, entry)
+        if DOWNLOAD_OFFLOAD:
+            response = offloaded_download(filename, filepath, etag)
+        else:
+            # send_file answers If-None-Match with 304 and Range/If-Range with 206;
+            # it resolves relative paths against the app root, not the working directory
+            response = send_file(
+                os.path.abspath(filepath),
+                as_attachment=True,
+                download_name=DOWNLOAD_NAME,
+                mimetype='application/pdf',
+                etag=etag,
+                conditional=True
+            )
+
+        # Files are immutable until they expire; only the owning session may see them
+        max_age = int(entry['expires_at'] - time.time()) if entry else 0
+        response.headers['Cache-Control'] = (f'private, max-age={max_age}, immutable' if max_age > 0
+                                             else 'private, no-cache')
+        response.headers.pop('Expires', None)
+
+        logger.info(f"File downloaded: {filename} ({response.status_code})")
         return response
 
     except Exception as e:
         logger.error(f"Download error: {e}")
         return f"Download fejl: {str(e)}", 500
 
+def download_etag(filename, filepath, entry):
+    """Strong ETag: the content digest, or for uncatalogued files a digest of name, size and mtime"""
+    if entry and entry.get('digest'):
+        return entry['digest']
+    st = os.stat(filepath)
+    return hashlib.sha256(f"{filename}|{st.st_size}|{st.st_mtime_ns}".encode()).hexdigest()
+
+def offloaded_download(filename, filepath, etag):
+    """
+    Response that leaves sending the file to the front proxy; the proxy also
+    serves Range requests. Conditional requests are answered here with 304.
+    """
+    response = app.response_class(mimetype='application/pdf')
+    response.set_etag(etag)
+    response.last_modified = os.path.getmtime(filepath)
+    response = response.make_conditional(request)
+    if response.status_code == 200:
+        response.headers['Content-Disposition'] = f'attachment; filename={DOWNLOAD_NAME}'
+        # As werkzeug's own X-Sendfile support does, announce the length the proxy will send
+        response.content_length = os.path.getsize(filepath)
+        if DOWNLOAD_OFFLOAD == 'x-accel-redirect':
+            response.headers['X-Accel-Redirect'] = X_ACCEL_REDIRECT_PREFIX + quote(filename)
+        else:
+            response.headers['X-Sendfile'] = os.path.abspath(filepath)
+    return response
+
 @app.route('/delete-image', methods=['POST'])
 def delete_image():
     """Enhanced image deletion with better security"""
@@ -477,21 +1285,17 @@ def delete_image():
 
         # Security check: only allow deletion of own files
         session_id = session.get('session_id', '')
-        if not filename.startswith(session_id):
+        if not owns_file(filename, session_id):
             logger.warning(f"Unauthorized delete attempt: {filename} from session {session_id}")
             return jsonify({'error': 'Uautoriseret adgang'}), 403
 
         filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
         if os.path.exists(filepath):
             try:
-                os.remove(filepath)
+                remove_upload(filepath)
                 
                 # Remove from session data
-                if session_id in session_data and 'images' in session_data[session_id]:
-                    session_data[session_id]['images'] = [
-                        img for img in session_data[session_id]['images'] 
-                        if img['filename'] != filename
-                    ]
+                session_store.remove_image(session_id, filename)
                 
                 logger.info(f"File deleted: {filename}")
                 return jsonify({'success': True})
@@ -510,7 +1314,7 @@ def session_info():
     """Get session information for debugging"""
     try:
         session_id = session.get('session_id', 'unknown')
-        session_images = session_data.get(session_id, {}).get('images', [])
+        session_images = (session_store.get(session_id) or {}).get('images', [])
         
         return jsonify({
             'session_id': session_id,
@@ -562,14 +1366,16 @@ def print_startup_info():
     print("="*60 + "\n")
 
 if __name__ == '__main__':
-    # Ensure upload directory exists
-    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-    
-    # Start background cleanup task
-    start_cleanup_task()
+    # Ensure upload directory exists, catalog files left from earlier versions,
+    # then start background cleanup task
+    start_background_tasks()
     
     # Register cleanup on exit
     atexit.register(cleanup_old_files)
+    atexit.register(background_preprocessor.shutdown)
+    atexit.register(pdf_job_queue.shutdown)
+    atexit.register(render_executor.shutdown)
+    atexit.register(preprocess_executor.shutdown)
     
     # Print startup information
     print_startup_info()
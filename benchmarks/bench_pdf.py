@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+"""
+Benchmark the command-line and web PDF generators.
+
+Each (generator, report size) combination runs in a fresh subprocess with a
+cold derivative cache, so wall time and peak RSS are not skewed by earlier
+runs. The web-flat generator is the web generator with descriptions drawn
+as static text instead of form fields. Besides generation, the time to open
+the result is measured: parsing every page, annotation and form field with
+pypdf, and rasterising all pages with pdftoppm when it is installed.
+Results are written as JSON and can be compared against a stored
+baseline; regressions beyond the thresholds make the script exit with 1.
+Time changes smaller than an absolute floor are ignored, as millisecond
+timings of small reports are dominated by noise.
+
+    python benchmarks/bench_pdf.py --output results.json
+    python benchmarks/bench_pdf.py --sizes 4 40 --baseline baseline.json
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+
+from corpus import CORPUS_VERSION, ensure_corpus  # noqa: E402
+
+GENERATORS = ('cli', 'web', 'web-flat')
+DEFAULT_SIZES = (4, 40, 400)
+DEFAULT_CORPUS_DIR = os.path.join(BENCH_DIR, '.corpus', f"v{CORPUS_VERSION}")
+
+# Relative increase over the baseline that counts as a regression
+DEFAULT_TIME_THRESHOLD = 0.15
+DEFAULT_MEMORY_THRESHOLD = 0.15
+DEFAULT_SIZE_THRESHOLD = 0.05
+# Seconds a time metric must grow by before its relative change counts
+DEFAULT_MIN_TIME_DELTA = 0.05
+
+# Metrics compared against the baseline: (result key, threshold argument, absolute floor argument)
+COMPARED_METRICS = (
+    ('wall_seconds', 'time_threshold', 'min_time_delta'),
+    ('peak_rss_bytes', 'memory_threshold', None),
+    ('pdf_bytes', 'size_threshold', None),
+    ('open_seconds', 'time_threshold', 'min_time_delta'),
+    ('view_seconds', 'time_threshold', 'min_time_delta'),
+)
+
+VIEW_DPI = 20  # Resolution pdftoppm rasterises at; low, as the form and page structure dominate
+
+
+def run_generator(generator, image_paths, output_pdf, workers):
+    """Render image_paths with one generator inside this process; returns wall seconds"""
+    from derivative_cache import DerivativeCache
+
+    cache = DerivativeCache(tempfile.mkdtemp(prefix='bench_cache_', dir=os.getcwd()))
+    if generator == 'cli':
+        import app
+        app.derivative_cache = cache
+        start = time.perf_counter()
+        result = app.create_pdf_with_grid_layout(os.path.dirname(image_paths[0]), output_pdf,
+                                                 workers=workers, image_paths=image_paths,
+                                                 verbose=False)
+    else:
+        import app_web
+        from concurrent.futures import ProcessPoolExecutor
+        app_web.derivative_cache = cache
+        app_web.preprocess_executor = ProcessPoolExecutor(max_workers=workers)
+        app_web.render_executor = ProcessPoolExecutor(max_workers=workers)
+        # As /generate-pdf passes them: validated at upload, bounded memory and
+        # parallel page ranges for large reports
+        images_data = [{'path': path, 'description': f"Billede {i + 1}", 'validated': True}
+                       for i, path in enumerate(image_paths)]
+        bounded = len(images_data) >= app_web.BOUNDED_MEMORY_MIN_IMAGES
+        parallel = workers > 1 and len(images_data) >= app_web.PARALLEL_RENDER_MIN_IMAGES
+        start = time.perf_counter()
+        result = app_web.create_pdf_from_uploaded_images(
+            images_data, output_pdf, workers=workers,
+            pages_per_part=app_web.PAGES_PER_PART if bounded else None,
+            render_workers=workers if parallel else None,
+            caption_mode='flat' if generator == 'web-flat' else 'fields')
+    elapsed = time.perf_counter() - start
+
+    if result is None:
+        raise RuntimeError(f"{generator} generator failed")
+    return elapsed
+
+
+def count_embedded_images(pdf_path):
+    """Images placed directly on the image pages; the header logo sits inside a form XObject"""
+    from pypdf import PdfReader
+    count = 0
+    for page in PdfReader(pdf_path).pages[1:]:
+        xobjects = page.get('/Resources', {}).get('/XObject', {})
+        count += sum(1 for xobject in xobjects.values() if xobject.get_object().get('/Subtype') == '/Image')
+    return count
+
+
+def measure_open(pdf_path):
+    """Seconds to parse every page with its annotations and the form fields, as a viewer must"""
+    from pypdf import PdfReader
+    start = time.perf_counter()
+    reader = PdfReader(pdf_path)
+    for page in reader.pages:
+        for annotation in page.get('/Annots') or []:
+            annotation.get_object()
+    reader.get_fields()
+    return time.perf_counter() - start
+
+
+def measure_view(pdf_path):
+    """Seconds pdftoppm needs to rasterise all pages, form fields included; None without pdftoppm"""
+    if shutil.which('pdftoppm') is None:
+        return None
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.perf_counter()
+        subprocess.run(['pdftoppm', '-r', str(VIEW_DPI), pdf_path, os.path.join(directory, 'page')],
+                       check=True, capture_output=True)
+        return time.perf_counter() - start
+
+
+def run_one(args):
+    """Child process entry point: run once and print the measurements as JSON"""
+    import resource
+    from resource_usage import peak_rss_bytes
+
+    image_paths = ensure_corpus(args.corpus_dir, args.run_one_images)
+    output_pdf = os.path.join(os.getcwd(), 'bench.pdf')
+    elapsed = run_generator(args.run_one, image_paths, output_pdf, args.workers)
+    # Every corpus image is valid; a missing one means a generator dropped it
+    embedded = count_embedded_images(output_pdf)
+    if embedded != len(image_paths):
+        raise RuntimeError(f"{args.run_one} embedded {embedded} of {len(image_paths)} images")
+
+    if args.run_one != 'cli':
+        # The web app keeps its pools running; reap them so their workers count below
+        import app_web
+        app_web.preprocess_executor.shutdown()
+        app_web.render_executor.shutdown()
+
+    # Process pool workers are children of this process
+    worker_peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    if sys.platform != 'darwin':
+        worker_peak *= 1024
+    print(json.dumps({
+        'wall_seconds': elapsed,
+        'peak_rss_bytes': peak_rss_bytes(),
+        'peak_worker_rss_bytes': worker_peak,
+        'pdf_bytes': os.path.getsize(output_pdf),
+        'open_seconds': measure_open(output_pdf),
+        'view_seconds': measure_view(output_pdf),
+    }))
+
+
+def measure(generator, images, args):
+    """Run a generator in a fresh subprocess and working directory"""
+    workdir = tempfile.mkdtemp(prefix='bench_')
+    try:
+        # Module-level paths (logo, caches, logs, databases) resolve inside the workdir
+        os.symlink(os.path.join(REPO_DIR, 'logo.png'), os.path.join(workdir, 'logo.png'))
+        command = [sys.executable, os.path.abspath(__file__), '--run-one', generator,
+                   '--run-one-images', str(images), '--corpus-dir', os.path.abspath(args.corpus_dir),
+                   '--workers', str(args.workers)]
+        completed = subprocess.run(command, cwd=workdir, capture_output=True, text=True)
+        if completed.returncode != 0:
+            raise RuntimeError(f"{generator}/{images} failed:\n{completed.stderr[-2000:]}")
+        return json.loads(completed.stdout.strip().splitlines()[-1])
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def run_suite(args):
+    print(f"Preparing corpus of {max(args.sizes)} images in {args.corpus_dir}")
+    ensure_corpus(args.corpus_dir, max(args.sizes))
+
+    results = []
+    for generator in args.generators:
+        for images in args.sizes:
+            runs = [measure(generator, images, args) for _ in range(args.repeat)]
+            wall = statistics.median(run['wall_seconds'] for run in runs)
+            result = {
+                'generator': generator,
+                'images': images,
+                'wall_seconds': wall,
+                'images_per_second': images / wall,
+                'peak_rss_bytes': max(run['peak_rss_bytes'] for run in runs),
+                'peak_worker_rss_bytes': max(run['peak_worker_rss_bytes'] for run in runs),
+                'pdf_bytes': runs[-1]['pdf_bytes'],
+                'open_seconds': statistics.median(run['open_seconds'] for run in runs),
+                'view_seconds': runs[-1]['view_seconds'],
+                'runs': [run['wall_seconds'] for run in runs],
+            }
+            results.append(result)
+            view = result['view_seconds']
+            print(f"{generator:>8} {images:>5} images: {wall:8.2f}s  {result['images_per_second']:7.1f} img/s  "
+                  f"peak {result['peak_rss_bytes'] / 2**20:7.1f} MB  "
+                  f"workers {result['peak_worker_rss_bytes'] / 2**20:7.1f} MB  "
+                  f"pdf {result['pdf_bytes'] / 2**20:7.2f} MB  "
+                  f"open {result['open_seconds']:6.2f}s" + (f"  view {view:6.2f}s" if view is not None else ""))
+
+    return {
+        'meta': environment_info(args),
+        'results': results,
+    }
+
+
+def environment_info(args):
+    import PIL
+    import reportlab
+    return {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'workers': args.workers,
+        'pillow': PIL.__version__,
+        'reportlab': reportlab.Version,
+        'corpus_version': CORPUS_VERSION,
+        'repeat': args.repeat,
+    }
+
+
+def compare(current, baseline, args):
+    """Print a comparison with the baseline; returns the list of regressions"""
+    baseline_results = {(r['generator'], r['images']): r for r in baseline['results']}
+    regressions = []
+    print("\nComparison with baseline:")
+    for result in current['results']:
+        key = (result['generator'], result['images'])
+        previous = baseline_results.get(key)
+        if previous is None:
+            print(f"{key[0]:>8} {key[1]:>5} images: not in baseline")
+            continue
+        changes = []
+        for metric, threshold_name, floor_name in COMPARED_METRICS:
+            if not previous.get(metric) or result.get(metric) is None:
+                continue
+            change = result[metric] / previous[metric] - 1
+            floor = getattr(args, floor_name) if floor_name else 0
+            regressed = (change > getattr(args, threshold_name)
+                         and result[metric] - previous[metric] > floor)
+            changes.append(f"{metric} {change:+.1%}{' REGRESSION' if regressed else ''}")
+            if regressed:
+                regressions.append((key, metric, change))
+        print(f"{key[0]:>8} {key[1]:>5} images: " + ", ".join(changes))
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the PDF generators")
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES),
+                        help="report sizes in images (default: 4 40 400)")
+    parser.add_argument('--generators', nargs='+', choices=GENERATORS, default=list(GENERATORS))
+    parser.add_argument('--repeat', type=int, default=1, help="runs per combination; the median time is kept")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help="image preprocessing processes")
+    parser.add_argument('--corpus-dir', default=DEFAULT_CORPUS_DIR)
+    parser.add_argument('--output', help="write results as JSON to this file")
+    parser.add_argument('--baseline', help="compare with results stored by an earlier run")
+    parser.add_argument('--time-threshold', type=float, default=DEFAULT_TIME_THRESHOLD)
+    parser.add_argument('--memory-threshold', type=float, default=DEFAULT_MEMORY_THRESHOLD)
+    parser.add_argument('--size-threshold', type=float, default=DEFAULT_SIZE_THRESHOLD)
+    parser.add_argument('--min-time-delta', type=float, default=DEFAULT_MIN_TIME_DELTA,
+                        help="ignore time increases below this many seconds (default: 0.05)")
+    # Internal: used by the parent to run a single measurement
+    parser.add_argument('--run-one', choices=GENERATORS, help=argparse.SUPPRESS)
+    parser.add_argument('--run-one-images', type=int, help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.run_one:
+        run_one(args)
+        return 0
+
+    current = run_suite(args)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(current, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(current, baseline, args)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) over the thresholds")
+            return 1
+        print("\nNo regressions")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Deterministic synthetic image corpus for the PDF benchmarks.
+
+Images cycle through the formats and modes the generators handle: large
+phone-sized JPEGs like the ones in billeder/, a JPEG only slightly larger
+than its place in the grid, RGBA and palette PNGs with transparency, GIF
+and BMP. Every image is derived from a seeded random
+generator, so the same index always produces the same file.
+"""
+
+import os
+import random
+from PIL import Image, ImageDraw
+
+# Bump when the synthesized images change, so old corpora are not reused
+CORPUS_VERSION = 2
+
+# (name, size, mode, format, extension) cycled by image index
+IMAGE_KINDS = (
+    ('jpeg_landscape', (4032, 3024), 'RGB', 'JPEG', 'jpg'),
+    ('jpeg_portrait', (3024, 4032), 'RGB', 'JPEG', 'jpeg'),
+    ('png_rgba', (1280, 960), 'RGBA', 'PNG', 'png'),
+    ('png_palette', (1024, 768), 'P', 'PNG', 'png'),
+    ('gif', (800, 600), 'P', 'GIF', 'gif'),
+    ('bmp', (1024, 768), 'RGB', 'BMP', 'bmp'),
+    # Between one and two times the 260 pt grid cell, where no reduced JPEG decode applies
+    ('jpeg_small', (400, 300), 'RGB', 'JPEG', 'jpg'),
+)
+
+TEXTURE_SCALE = 8  # Noise is drawn at 1/8 size and upscaled, like photo grain
+
+
+def synthesize_image(index):
+    """The index-th corpus image as (PIL image, kind)"""
+    name, size, mode, image_format, extension = IMAGE_KINDS[index % len(IMAGE_KINDS)]
+    rng = random.Random(f"{CORPUS_VERSION}:{index}")
+    width, height = size
+
+    # Smooth colour gradients as a base, like sky and walls in site photos
+    channels = [Image.linear_gradient('L').rotate(rng.uniform(0, 360)).resize(size)
+                for _ in range(3)]
+    img = Image.merge('RGB', channels)
+
+    # Shapes with hard edges
+    draw = ImageDraw.Draw(img)
+    for _ in range(40):
+        x0, y0 = rng.randrange(width), rng.randrange(height)
+        x1, y1 = x0 + rng.randrange(width // 4), y0 + rng.randrange(height // 4)
+        colour = tuple(rng.randrange(256) for _ in range(3))
+        if rng.random() < 0.5:
+            draw.rectangle((x0, y0, x1, y1), fill=colour)
+        else:
+            draw.ellipse((x0, y0, x1, y1), fill=colour)
+
+    # Fine grain so the images do not compress unrealistically well
+    texture_size = (max(1, width // TEXTURE_SCALE), max(1, height // TEXTURE_SCALE))
+    noise = Image.frombytes('RGB', texture_size,
+                            rng.randbytes(texture_size[0] * texture_size[1] * 3))
+    img = Image.blend(img, noise.resize(size, Image.BICUBIC), 0.15)
+
+    if mode == 'RGBA':
+        alpha = Image.linear_gradient('L').rotate(rng.uniform(0, 360)).resize(size)
+        img.putalpha(alpha)
+    elif mode == 'P':
+        img = img.quantize(colors=rng.choice((16, 64, 255)))
+        # Use the first palette entry as the transparent colour
+        img.info['transparency'] = 0
+
+    return img, (name, image_format, extension)
+
+
+def corpus_path(corpus_dir, index):
+    extension = IMAGE_KINDS[index % len(IMAGE_KINDS)][4]
+    return os.path.join(corpus_dir, f"img_{index:04d}.{extension}")
+
+
+def ensure_corpus(corpus_dir, count):
+    """Paths of the first `count` corpus images, synthesizing any that are missing"""
+    os.makedirs(corpus_dir, exist_ok=True)
+    paths = []
+    for index in range(count):
+        path = corpus_path(corpus_dir, index)
+        if not os.path.exists(path):
+            img, (_, image_format, _) = synthesize_image(index)
+            save_options = {'quality': 92} if image_format == 'JPEG' else {}
+            if image_format in ('PNG', 'GIF') and 'transparency' in img.info:
+                save_options['transparency'] = img.info['transparency']
+            tmp_path = path + '.tmp'
+            img.save(tmp_path, format=image_format, **save_options)
+            os.replace(tmp_path, path)
+        paths.append(path)
+    return paths
@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+"""
+Load test for the web version.
+
+Simulated users each keep their own session cookie and walk through the
+same flow as the browser: open the front page, upload images one by one
+through /upload, request a PDF through /generate-pdf, follow the job until
+it is done and download the result. Each user level runs with that many
+users at once, and latency percentiles, error rates and throughput are
+reported per endpoint.
+
+Everything runs offline. By default a server is started from this checkout
+in a temporary working directory on a free local port; use --url to test a
+server that is already running.
+
+    python benchmarks/load_test.py --users 1 4 16
+    python benchmarks/load_test.py --url http://127.0.0.1:5000 --users 8 --flows 3
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import urllib.error
+import urllib.request
+from http.cookiejar import CookieJar
+from collections import defaultdict
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from corpus import CORPUS_VERSION, IMAGE_KINDS, ensure_corpus  # noqa: E402
+
+DEFAULT_USERS = (1, 4, 16)
+DEFAULT_CORPUS_DIR = os.path.join(BENCH_DIR, '.corpus', f"v{CORPUS_VERSION}")
+DEFAULT_CORPUS_IMAGES = 12
+PERCENTILES = (50, 95, 99)
+JOB_POLL_INTERVAL = 0.2  # Seconds between PDF job status requests
+JOB_TIMEOUT = 600  # Seconds a PDF job may take before the flow counts as failed
+SERVER_START_TIMEOUT = 60
+
+# Endpoints in report order; 'pdf_ready' is the time from /generate-pdf until the job is done
+ENDPOINTS = ('index', 'upload', 'generate_pdf', 'pdf_job', 'pdf_ready', 'download')
+
+
+class FlowError(Exception):
+    """Raised when a step fails and the rest of the flow cannot continue"""
+
+
+def encode_multipart(fields, files):
+    """Body and content type for a multipart/form-data request"""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n'
+                     f'{value}\r\n'.encode())
+    for name, (filename, data, content_type) in files.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; '
+                     f'filename="{filename}"\r\nContent-Type: {content_type}\r\n\r\n'.encode())
+        parts.append(data)
+        parts.append(b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+def content_type_for(path):
+    extension = path.rsplit('.', 1)[-1].lower()
+    return {'jpg': 'image/jpeg', 'jpeg': 'image/jpeg', 'png': 'image/png',
+            'gif': 'image/gif', 'bmp': 'image/bmp'}[extension]
+
+
+class Recorder:
+    """Latencies and status codes per endpoint, shared by all users of a level"""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, seconds, status, ok):
+        with self._lock:
+            self.latencies[endpoint].append(seconds)
+            self.statuses[endpoint][status] += 1
+            if not ok:
+                self.errors[endpoint] += 1
+
+    def summary(self, wall_seconds):
+        endpoints = {}
+        for endpoint in ENDPOINTS:
+            latencies = sorted(self.latencies.get(endpoint, ()))
+            if not latencies:
+                continue
+            endpoints[endpoint] = {
+                'requests': len(latencies),
+                'errors': self.errors.get(endpoint, 0),
+                'error_rate': self.errors.get(endpoint, 0) / len(latencies),
+                'throughput': len(latencies) / wall_seconds,
+                'mean_seconds': sum(latencies) / len(latencies),
+                **{f'p{p}_seconds': percentile(latencies, p) for p in PERCENTILES},
+                'statuses': {str(status): count for status, count in sorted(self.statuses[endpoint].items())},
+            }
+        return endpoints
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list"""
+    rank = max(1, -(-len(sorted_values) * p // 100))
+    return sorted_values[int(rank) - 1]
+
+
+class SimulatedUser:
+    """One browser session with its own cookie jar"""
+
+    def __init__(self, base_url, recorder, image_paths, unique_uploads):
+        self.base_url = base_url.rstrip('/')
+        self.recorder = recorder
+        self.image_paths = image_paths
+        self.unique_uploads = unique_uploads
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(CookieJar()))
+
+    def request(self, endpoint, path, data=None, headers=None, ok_statuses=(200,)):
+        """Timed request; returns (status, body) and records the outcome"""
+        req = urllib.request.Request(self.base_url + path, data=data, headers=headers or {})
+        started = time.perf_counter()
+        try:
+            with self.opener.open(req) as response:
+                status, body = response.status, response.read()
+        except urllib.error.HTTPError as e:
+            status, body = e.code, e.read()
+        except OSError as e:
+            self.recorder.record(endpoint, time.perf_counter() - started, type(e).__name__, False)
+            raise FlowError(f"{endpoint}: {e}")
+        ok = status in ok_statuses
+        self.recorder.record(endpoint, time.perf_counter() - started, status, ok)
+        if not ok:
+            raise FlowError(f"{endpoint}: HTTP {status}")
+        return status, body
+
+    def upload_data(self, path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        if self.unique_uploads:
+            # Trailing bytes after the image data keep it valid but give every
+            # upload its own digest, so dedup and derivative caches miss
+            data += uuid.uuid4().bytes
+        return data
+
+    def run_flow(self):
+        self.request('index', '/')
+
+        filenames = []
+        for path in self.image_paths:
+            body, content_type = encode_multipart(
+                {}, {'file': (os.path.basename(path), self.upload_data(path), content_type_for(path))})
+            _, response = self.request('upload', '/upload', body, {'Content-Type': content_type})
+            filenames.append(json.loads(response)['filename'])
+
+        images = [{'filename': filename, 'description': f"Billede {i + 1}"}
+                  for i, filename in enumerate(filenames)]
+        submitted = time.perf_counter()
+        status, response = self.request('generate_pdf', '/generate-pdf',
+                                        json.dumps({'images': images}).encode(),
+                                        {'Content-Type': 'application/json'}, ok_statuses=(200, 202))
+        job = json.loads(response)
+
+        # 202 means queued; follow the job until it finishes
+        deadline = time.monotonic() + JOB_TIMEOUT
+        while job.get('status') not in ('done', 'failed'):
+            if time.monotonic() > deadline:
+                self.recorder.record('pdf_ready', time.perf_counter() - submitted, 'timeout', False)
+                raise FlowError("PDF job timed out")
+            time.sleep(JOB_POLL_INTERVAL)
+            _, response = self.request('pdf_job', job['status_url'])
+            job = {'status_url': job['status_url'], **json.loads(response)}
+        ok = job['status'] == 'done'
+        self.recorder.record('pdf_ready', time.perf_counter() - submitted, job['status'], ok)
+        if not ok:
+            raise FlowError(f"PDF job failed: {job.get('error')}")
+
+        self.request('download', job['download_url'])
+
+
+def run_level(base_url, users, flows, image_sets, unique_uploads):
+    """Run `users` simulated users at once, each doing `flows` flows"""
+    recorder = Recorder()
+    failures = []
+
+    def user_main(index):
+        user = SimulatedUser(base_url, recorder, image_sets[index % len(image_sets)], unique_uploads)
+        for _ in range(flows):
+            try:
+                user.run_flow()
+            except FlowError as e:
+                failures.append(str(e))
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=user_main, args=(i,)) for i in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    return {
+        'users': users,
+        'flows': users * flows,
+        'failed_flows': len(failures),
+        'wall_seconds': wall,
+        'flows_per_second': users * flows / wall,
+        'endpoints': recorder.summary(wall),
+        'failures': failures[:20],
+    }
+
+
+def print_level(level):
+    print(f"\n{level['users']} user(s): {level['flows']} flows in {level['wall_seconds']:.1f}s, "
+          f"{level['failed_flows']} failed, {level['flows_per_second']:.2f} flows/s")
+    print(f"  {'endpoint':<13} {'requests':>8} {'errors':>7} {'req/s':>7} "
+          + ' '.join(f"{f'p{p}':>8}" for p in PERCENTILES))
+    for endpoint, stats in level['endpoints'].items():
+        print(f"  {endpoint:<13} {stats['requests']:>8} {stats['error_rate']:>7.1%} {stats['throughput']:>7.2f} "
+              + ' '.join(f"{stats[f'p{p}_seconds'] * 1000:>6.0f}ms" for p in PERCENTILES))
+    for failure in level['failures'][:5]:
+        print(f"  ! {failure}")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def serve(port):
+    """Child process entry point: run app_web from the current directory"""
+    sys.path.insert(0, REPO_DIR)
+    import app_web
+    os.makedirs(app_web.app.config['UPLOAD_FOLDER'], exist_ok=True)
+    app_web.app.run(host='127.0.0.1', port=port, threaded=True, debug=False, use_reloader=False)
+
+
+def start_server():
+    """Start app_web in a temporary working directory; returns (process, base_url, workdir)"""
+    workdir = tempfile.mkdtemp(prefix='loadtest_')
+    # Module-level paths (logo, caches, logs, databases) resolve inside the workdir
+    os.symlink(os.path.join(REPO_DIR, 'logo.png'), os.path.join(workdir, 'logo.png'))
+    port = free_port()
+    process = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve', str(port)],
+                               cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while True:
+        try:
+            urllib.request.urlopen(base_url + '/config', timeout=1).close()
+            return process, base_url, workdir
+        except OSError:
+            if process.poll() is not None or time.monotonic() > deadline:
+                process.kill()
+                shutil.rmtree(workdir, ignore_errors=True)
+                raise RuntimeError("The web app did not start")
+            time.sleep(0.2)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the web version")
+    parser.add_argument('--url', help="test a running server instead of starting one")
+    parser.add_argument('--users', type=int, nargs='+', default=list(DEFAULT_USERS),
+                        help="concurrent users per level (default: 1 4 16)")
+    parser.add_argument('--flows', type=int, default=1, help="flows per user and level")
+    parser.add_argument('--images-per-user', type=int, default=8)
+    parser.add_argument('--corpus-dir', default=DEFAULT_CORPUS_DIR)
+    parser.add_argument('--corpus-images', type=int, default=DEFAULT_CORPUS_IMAGES,
+                        help="distinct corpus images the users pick from")
+    parser.add_argument('--shared-images', action='store_true',
+                        help="upload identical bytes across users, so dedup and caches hit")
+    parser.add_argument('--output', help="write results as JSON to this file")
+    parser.add_argument('--serve', type=int, help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.serve:
+        serve(args.serve)
+        return 0
+
+    corpus = ensure_corpus(args.corpus_dir, max(args.corpus_images, len(IMAGE_KINDS)))
+    # Each user starts at a different corpus image so users upload a format mix
+    image_sets = [[corpus[(start + i) % len(corpus)] for i in range(args.images_per_user)]
+                  for start in range(len(corpus))]
+
+    process = workdir = None
+    base_url = args.url
+    if base_url is None:
+        process, base_url, workdir = start_server()
+        print(f"Started web app at {base_url}")
+    try:
+        levels = []
+        for users in args.users:
+            level = run_level(base_url, users, args.flows, image_sets, not args.shared_images)
+            print_level(level)
+            levels.append(level)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'url': base_url, 'images_per_user': args.images_per_user,
+                       'unique_uploads': not args.shared_images, 'levels': levels}, f, indent=2)
+        print(f"\nResults written to {args.output}")
+    return 1 if any(level['failed_flows'] for level in levels) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Content-addressed storage of uploaded files.
+
+Every distinct upload is stored once as a blob named by its SHA-256 digest.
+Session files are hard links to the blob, so the file system keeps the
+reference count: a blob whose link count drops to one is no longer used by
+any session and is removed.
+"""
+
+import os
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+BLOB_DIR_NAME = 'blobs'
+
+
+class BlobStore:
+    """Deduplicated blobs under root, referenced through hard links"""
+
+    def __init__(self, root):
+        self.root = root
+        # Serialises linking against releasing so a blob is never removed
+        # between being found and being linked
+        self._lock = threading.Lock()
+
+    def blob_path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def store(self, source_path, digest, dest_path):
+        """
+        Link dest_path to the blob for digest, creating the blob from
+        source_path if the content is new. Returns True if it was new.
+        """
+        blob = self.blob_path(digest)
+        with self._lock:
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            try:
+                os.link(source_path, blob)
+                created = True
+            except FileExistsError:
+                # Keep the shared blob from looking stale to the cleanup
+                os.utime(blob)
+                created = False
+            os.link(blob, dest_path)
+        return created
+
+    def release(self, path, digest):
+        """
+        Remove a session file, and its blob once no other file references it.
+        Returns True if the blob was removed.
+        """
+        blob = self.blob_path(digest)
+        with self._lock:
+            os.remove(path)
+            return self._remove_if_unreferenced(blob)
+
+    def _remove_if_unreferenced(self, blob):
+        try:
+            if os.stat(blob).st_nlink <= 1:
+                os.remove(blob)
+                return True
+        except FileNotFoundError:
+            pass
+        return False
+
+    def sweep(self):
+        """Remove blobs left without references, e.g. after a crash"""
+        removed = 0
+        try:
+            subdirs = list(os.scandir(self.root))
+        except FileNotFoundError:
+            return 0
+        for subdir in subdirs:
+            if not subdir.is_dir():
+                continue
+            for entry in os.scandir(subdir.path):
+                with self._lock:
+                    if self._remove_if_unreferenced(entry.path):
+                        removed += 1
+        if removed:
+            logger.info(f"Removed {removed} unreferenced blobs")
+        return removed
+
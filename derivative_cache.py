@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Content-addressed on-disk cache of PDF-ready image derivatives.
+
+Entries are keyed by the SHA-256 of the source file plus every render
+parameter that affects the encoded result, so an unchanged image rendered
+with unchanged settings is never decoded again. The cache is bounded in size
+and evicts the least recently used entries first.
+"""
+
+import os
+import struct
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Bump when the preprocessing output changes so stale derivatives are ignored
+CACHE_FORMAT_VERSION = 1
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024  # 512MB
+EVICTION_TARGET = 0.9  # Evict down to 90% of the limit to avoid evicting on every write
+HASH_CHUNK_SIZE = 1024 * 1024
+DIGEST_MEMO_SIZE = 10000  # Remembered (path, size, mtime) -> digest entries
+
+# Each entry starts with the drawn width and height in points
+_HEADER = struct.Struct('<dd')
+_ENTRY_SUFFIX = '.drv'
+
+
+def file_digest(path):
+    """SHA-256 hex digest of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class DerivativeCache:
+    """Size-bounded LRU cache of encoded derivatives stored under cache_dir"""
+
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._total_bytes = None  # Computed lazily on first write
+        self._digests = OrderedDict()
+
+    def source_digest(self, path):
+        """Digest of a source file, memoized by path, size and mtime"""
+        memo_key = self._memo_key(path)
+        with self._lock:
+            digest = self._digests.get(memo_key)
+            if digest is not None:
+                self._digests.move_to_end(memo_key)
+                return digest
+
+        digest = file_digest(path)
+        self._remember(memo_key, digest)
+        return digest
+
+    def remember_digest(self, path, digest):
+        """Record an already known digest of a source file, e.g. computed during upload"""
+        self._remember(self._memo_key(path), digest)
+
+    def _memo_key(self, path):
+        st = os.stat(path)
+        return (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+
+    def _remember(self, memo_key, digest):
+        with self._lock:
+            self._digests[memo_key] = digest
+            if len(self._digests) > DIGEST_MEMO_SIZE:
+                self._digests.popitem(last=False)
+
+    def key(self, source_digest, max_width, max_height, quality, dpi):
+        """Cache key for a source digest rendered with the given parameters"""
+        params = f"{source_digest}|{max_width}|{max_height}|{quality}|{dpi}|v{CACHE_FORMAT_VERSION}"
+        return hashlib.sha256(params.encode('ascii')).hexdigest()
+
+    def key_for_file(self, path, max_width, max_height, quality, dpi):
+        return self.key(self.source_digest(path), max_width, max_height, quality, dpi)
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + _ENTRY_SUFFIX)
+
+    def contains(self, key):
+        """Check for an entry without reading it or touching the counters"""
+        return os.path.exists(self._entry_path(key))
+
+    def get(self, key):
+        """Return the cached (data, width, height) for key, or None"""
+        path = self._entry_path(key)
+        try:
+            with open(path, 'rb') as f:
+                blob = f.read()
+            # Mark as recently used for LRU eviction
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        except OSError as e:
+            logger.warning(f"Could not read cached derivative {path}: {e}")
+            with self._lock:
+                self.misses += 1
+            return None
+
+        if len(blob) < _HEADER.size:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        width, height = _HEADER.unpack_from(blob)
+        with self._lock:
+            self.hits += 1
+        return blob[_HEADER.size:], width, height
+
+    def put(self, key, result):
+        """Store a (data, width, height) derivative under key"""
+        data, width, height = result
+        path = self._entry_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temporary file first so readers never see partial entries
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(_HEADER.pack(width, height))
+                f.write(data)
+            # Background and inline preprocessing can store the same key; an
+            # overwritten entry only changes the total by the size difference
+            with self._lock:
+                try:
+                    replaced_bytes = os.stat(path).st_size
+                except FileNotFoundError:
+                    replaced_bytes = 0
+                os.replace(tmp_path, path)
+                if self._total_bytes is not None:
+                    self._total_bytes += _HEADER.size + len(data) - replaced_bytes
+        except OSError as e:
+            logger.warning(f"Could not cache derivative {path}: {e}")
+            return
+
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = self._scan_size()
+            over_limit = self._total_bytes > self.max_bytes
+        if over_limit:
+            self.evict()
+
+    def _iter_entries(self):
+        try:
+            subdirs = list(os.scandir(self.cache_dir))
+        except FileNotFoundError:
+            return
+        for subdir in subdirs:
+            if not subdir.is_dir():
+                continue
+            for entry in os.scandir(subdir.path):
+                if entry.name.endswith(_ENTRY_SUFFIX):
+                    yield entry
+
+    def _scan_size(self):
+        return sum(entry.stat().st_size for entry in self._iter_entries())
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits its budget"""
+        entries = []
+        for entry in self._iter_entries():
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, entry.path))
+        entries.sort()
+
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * EVICTION_TARGET
+        removed = 0
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"Could not evict cached derivative {path}: {e}")
+                continue
+            total -= size
+            removed += 1
+
+        with self._lock:
+            self._total_bytes = total
+        if removed:
+            logger.info(f"Evicted {removed} cached derivatives")
+
+    def stats(self):
+        """Hit/miss counters and current size"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'bytes': self._total_bytes,
+            }
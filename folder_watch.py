@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Polling watcher for image folders.
+
+Every poll lists the watched folders with os.scandir and compares the size
+and mtime of each image with the previous poll. This needs no OS-specific
+change notification APIs and also works on network shares, where those are
+unreliable. Changes are only reported once the folders have been quiet for
+the debounce period, so copying a burst of photos, or one large photo that
+grows while it is copied, triggers a single rebuild.
+"""
+
+import os
+import time
+
+DEFAULT_INTERVAL = 1.0  # Seconds between polls
+DEFAULT_DEBOUNCE = 2.0  # Seconds without changes before they are reported
+
+
+def scan_images(folder, extensions, recursive=False, skip_dirs=()):
+    """{path: (size, mtime_ns)} of the image files in folder; hidden folders are skipped"""
+    images = {}
+    pending = [folder]
+    while pending:
+        directory = pending.pop()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if recursive and not entry.name.startswith('.') and entry.name not in skip_dirs:
+                                pending.append(entry.path)
+                        elif entry.name.lower().endswith(extensions):
+                            st = entry.stat()
+                            images[entry.path] = (st.st_size, st.st_mtime_ns)
+                    except FileNotFoundError:
+                        continue  # Removed while the folder was listed
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+    return images
+
+
+class Changes:
+    """Images added, changed and removed between two snapshots"""
+
+    def __init__(self, previous, current):
+        self.added = sorted(path for path in current if path not in previous)
+        self.removed = sorted(path for path in previous if path not in current)
+        self.changed = sorted(path for path in current
+                              if path in previous and previous[path] != current[path])
+
+    def __bool__(self):
+        return bool(self.added or self.changed or self.removed)
+
+
+class FolderWatcher:
+    """Reports image changes found by scan(), a function returning a scan_images snapshot"""
+
+    def __init__(self, scan, interval=DEFAULT_INTERVAL, debounce=DEFAULT_DEBOUNCE):
+        self.scan = scan
+        self.interval = interval
+        self.debounce = debounce
+        self.snapshot = scan()
+
+    def wait_for_changes(self):
+        """
+        Block until the images differ from the last reported state and have
+        then stayed unchanged for the debounce period; returns the Changes
+        """
+        while True:
+            time.sleep(self.interval)
+            current = self.scan()
+            if current == self.snapshot:
+                continue
+
+            # Keep polling until a whole debounce period passes without changes
+            quiet_since = time.monotonic()
+            while time.monotonic() - quiet_since < self.debounce:
+                time.sleep(min(self.interval, self.debounce))
+                latest = self.scan()
+                if latest != current:
+                    current = latest
+                    quiet_since = time.monotonic()
+
+            changes = Changes(self.snapshot, current)
+            self.snapshot = current
+            # A file that was added and removed again within the burst leaves nothing to do
+            if changes:
+                return changes
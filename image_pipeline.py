@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+"""
+Image preprocessing pipeline shared by the command line and web versions.
+
+Decoding, colour conversion, thumbnailing and JPEG encoding are CPU bound and
+independent per image, so they are fanned out over a process pool. Results are
+handed back in input order so the ReportLab canvas can still be assembled
+sequentially with an unchanged page layout.
+"""
+
+import os
+import time
+import logging
+import threading
+from io import BytesIO
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
+from reportlab.lib.utils import ImageReader
+from image_probe import (ImageTooLargeError, check_pixel_limit, estimate_decode_bytes,
+                         jpeg_draft_size)
+
+logger = logging.getLogger(__name__)
+
+# Default number of worker processes for image preprocessing
+DEFAULT_WORKERS = os.cpu_count() or 1
+
+# Number of queued images per worker; bounds memory held by finished results
+QUEUE_DEPTH_PER_WORKER = 2
+
+# PDF user space is 72 points per inch; a DPI of 72 embeds one pixel per point
+POINTS_PER_INCH = 72
+DEFAULT_DPI = 72
+
+# Modes Pillow can resample directly; anything else is converted before scaling
+RESAMPLE_MODES = ('RGB', 'RGBA', 'L', 'LA', 'CMYK', 'YCbCr')
+
+# Image.thumbnail's default: decode JPEGs at no less than twice the target size
+THUMBNAIL_REDUCING_GAP = 2
+
+# Stages timed by prepare_image
+STAGES = ('decode', 'convert', 'thumbnail', 'encode')
+
+
+class StageTimer:
+    """
+    Add the time since the previous call to timings[stage].
+    Does nothing when timings is None, so untimed callers pay no bookkeeping.
+    """
+
+    def __init__(self, timings):
+        self.timings = timings
+        self._last = time.perf_counter() if timings is not None else None
+
+    def __call__(self, stage):
+        if self.timings is None:
+            return
+        now = time.perf_counter()
+        self.timings[stage] = self.timings.get(stage, 0) + now - self._last
+        self._last = now
+
+
+def target_pixel_size(max_width, max_height, dpi=DEFAULT_DPI):
+    """Pixel box for an image drawn at most max_width x max_height points"""
+    scale = dpi / POINTS_PER_INCH
+    return max(1, round(max_width * scale)), max(1, round(max_height * scale))
+
+
+def load_thumbnail(image_path, size, stage=None, max_decode_bytes=None):
+    """
+    Decode an image as an RGB image that fits within size pixels.
+
+    The image is scaled down before any colour conversion, so large photos
+    never exist as full-size RGB buffers. For JPEGs a draft decode lets
+    libjpeg scale by up to 1/8 in the DCT domain; other formats are shrunk
+    with reduce() before the final resample. Transparency is flattened
+    onto white.
+
+    The decode size is checked against the pixel limit and max_decode_bytes
+    before any pixels are decoded. JPEGs over the budget are decoded at the
+    smallest DCT scale that still covers the target size; images that do
+    not fit even then raise ImageTooLargeError.
+    """
+    if stage is None:
+        stage = StageTimer(None)
+    with Image.open(image_path) as source:
+        check_pixel_limit(source.width, source.height)
+        converts = source.mode not in RESAMPLE_MODES
+
+        # Decode JPEGs at the reduced DCT scale thumbnail() would pick itself
+        ratio = min(size[0] / source.width, size[1] / source.height)
+        if ratio < 1:
+            requested = (max(1, int(source.width * ratio * THUMBNAIL_REDUCING_GAP)),
+                         max(1, int(source.height * ratio * THUMBNAIL_REDUCING_GAP)))
+            if source.format == 'JPEG' and max_decode_bytes is not None:
+                draft_size = jpeg_draft_size(source.width, source.height, requested)
+                if estimate_decode_bytes(source.mode, *draft_size, converts) > max_decode_bytes:
+                    # Reduced decode: scale down as far as the target size allows
+                    requested = (max(1, int(source.width * ratio)), max(1, int(source.height * ratio)))
+            source.draft(None, requested)
+
+        # source.size is the draft size by now; nothing has been decoded yet
+        if max_decode_bytes is not None:
+            needed = estimate_decode_bytes(source.mode, source.width, source.height, converts)
+            if needed > max_decode_bytes:
+                raise ImageTooLargeError(f"decoding {image_path} needs {needed / 2**20:.1f} MB, "
+                                         f"more than the {max_decode_bytes / 2**20:.1f} MB budget")
+        source.load()
+        stage('decode')
+
+        img = source
+        if img.mode not in RESAMPLE_MODES:
+            # Palette and bilevel images cannot be resampled smoothly as-is
+            if img.mode == 'P' and 'transparency' in img.info:
+                img = img.convert('RGBA')
+            else:
+                img = img.convert('RGB')
+            stage('convert')
+
+        img.thumbnail(size, reducing_gap=THUMBNAIL_REDUCING_GAP)
+        stage('thumbnail')
+
+        # Flatten transparency onto white only after downscaling
+        if img.mode in ('RGBA', 'LA'):
+            if img.mode == 'LA':
+                img = img.convert('RGBA')
+            background = Image.new('RGB', img.size, (255, 255, 255))
+            background.paste(img, mask=img.getchannel('A'))
+            img = background
+        elif img.mode != 'RGB':
+            img = img.convert('RGB')
+        if img is source:
+            # Closing the source image would also release its pixels
+            img = img.copy()
+        stage('convert')
+    return img
+
+
+def prepare_image(image_path, max_width, max_height, quality, dpi=DEFAULT_DPI, timings=None,
+                  max_decode_bytes=None):
+    """
+    Convert an image to an RGB JPEG thumbnail ready for the PDF canvas,
+    decoded and scaled by load_thumbnail.
+
+    Returns (jpeg_bytes, width, height) with the size in points at `dpi`;
+    nothing is written to disk. If a timings dict is given, the seconds spent
+    in each stage are added to it under the STAGES names.
+    """
+    stage = StageTimer(timings)
+    img = load_thumbnail(image_path, target_pixel_size(max_width, max_height, dpi), stage,
+                         max_decode_bytes)
+
+    buffer = BytesIO()
+    img.save(buffer, format="JPEG", quality=quality, optimize=True)
+    pixel_width, pixel_height = img.size
+    stage('encode')
+
+    scale = POINTS_PER_INCH / dpi
+    return buffer.getvalue(), pixel_width * scale, pixel_height * scale
+
+
+def passthrough_jpeg(image_path, dpi=DEFAULT_DPI):
+    """
+    Use an RGB or greyscale JPEG that is already sized for the page as its own
+    derivative, without decoding or re-encoding it.
+
+    Returns (jpeg_bytes, width, height) like prepare_image.
+    """
+    with open(image_path, 'rb') as f:
+        data = f.read()
+    with Image.open(BytesIO(data)) as img:
+        if img.format != 'JPEG' or img.mode not in ('RGB', 'L'):
+            raise ValueError(f"{image_path} is not an RGB or greyscale JPEG")
+        pixel_width, pixel_height = img.size
+
+    scale = POINTS_PER_INCH / dpi
+    return data, pixel_width * scale, pixel_height * scale
+
+
+def image_reader(jpeg_bytes):
+    """
+    Wrap encoded JPEG bytes for canvas.drawImage.
+    ReportLab embeds JPEG data from a reader as-is, without re-encoding;
+    other formats (lossless PNG in size-budget mode) are embedded as
+    zlib-compressed RGB data.
+    """
+    return ImageReader(BytesIO(jpeg_bytes))
+
+
+def _prepare_image_task(args, max_decode_bytes=None):
+    """Process pool entry point; returns (result, error, stage timings) instead of raising"""
+    timings = {}
+    try:
+        return prepare_image(*args, timings=timings, max_decode_bytes=max_decode_bytes), None, timings
+    except Exception as e:
+        return None, e, timings
+
+
+def _cache_lookup(cache, path, params):
+    """Return (key, cached_result); key is None when the source cannot be hashed"""
+    if cache is None:
+        return None, None
+    try:
+        key = cache.key_for_file(path, *params)
+    except OSError:
+        # Unreadable source; let prepare_image report the error
+        return None, None
+    return key, cache.get(key)
+
+
+def iter_prepared_images(image_paths, max_width, max_height, quality, dpi=DEFAULT_DPI,
+                         workers=DEFAULT_WORKERS, cache=None, on_timings=None, max_decode_bytes=None,
+                         executor=None):
+    """
+    Yield (result, error) for every path, in input order.
+
+    With more than one worker the images are processed in a process pool while
+    the caller consumes earlier results. Only a bounded number of images is in
+    flight at any time, so memory does not grow with the size of the report.
+    A long-running caller can pass a shared ProcessPoolExecutor as executor;
+    it is left running and only this call's queued images are cancelled.
+    Otherwise a pool of `workers` processes is created for the call.
+
+    If a DerivativeCache is given, cached derivatives are returned without
+    touching the image, and the pool is only started on the first miss.
+    on_timings(timings) receives the stage timings of every image that was
+    actually processed. max_decode_bytes is the decode budget of each worker,
+    see prepare_image.
+    """
+    params = (max_width, max_height, quality, dpi)
+
+    def finish(key, outcome):
+        result, error, timings = outcome
+        if key is not None and error is None:
+            cache.put(key, result)
+        if on_timings is not None:
+            on_timings(timings)
+        return result, error
+
+    if workers <= 1 or len(image_paths) <= 1:
+        for path in image_paths:
+            key, cached = _cache_lookup(cache, path, params)
+            if cached is not None:
+                yield cached, None
+            else:
+                yield finish(key, _prepare_image_task((path,) + params, max_decode_bytes))
+        return
+
+    workers = min(workers, len(image_paths))
+    max_pending = workers * QUEUE_DEPTH_PER_WORKER
+    shared_executor = executor
+    try:
+        pending = deque()
+        remaining = iter(image_paths)
+        exhausted = False
+        while True:
+            while not exhausted and len(pending) < max_pending:
+                path = next(remaining, None)
+                if path is None:
+                    exhausted = True
+                    break
+                key, cached = _cache_lookup(cache, path, params)
+                if cached is not None:
+                    pending.append((None, None, (cached, None)))
+                    continue
+                if executor is None:
+                    executor = ProcessPoolExecutor(max_workers=workers)
+                pending.append((key, executor.submit(_prepare_image_task, (path,) + params,
+                                                     max_decode_bytes), None))
+
+            if not pending:
+                break
+            key, future, outcome = pending.popleft()
+            if future is not None:
+                outcome = finish(key, future.result())
+            yield outcome
+    finally:
+        if shared_executor is not None:
+            for _, future, _ in pending:
+                if future is not None:
+                    future.cancel()
+        elif executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+
+class BackgroundPreprocessor:
+    """
+    Precompute derivatives into a DerivativeCache on a background process pool.
+
+    Used to start image work as soon as a file is uploaded, so PDF generation
+    later finds the derivatives in the cache. wait() lets a generation run
+    pick up images that are still queued. on_timings(timings) receives the
+    stage timings of every processed image; max_decode_bytes is the decode
+    budget of each worker. A shared ProcessPoolExecutor passed as executor
+    is used instead of a pool of its own and is not shut down here.
+    """
+
+    def __init__(self, cache, workers=DEFAULT_WORKERS, on_timings=None, max_decode_bytes=None,
+                 executor=None):
+        self.cache = cache
+        self.workers = workers
+        self.on_timings = on_timings
+        self.max_decode_bytes = max_decode_bytes
+        self._executor = executor
+        self._owns_executor = executor is None
+        self._pending = {}  # path -> (future, done_event)
+        self._lock = threading.Lock()
+
+    def submit(self, path, max_width, max_height, quality, dpi=DEFAULT_DPI):
+        """Queue derivative generation for path unless it is cached already"""
+        params = (max_width, max_height, quality, dpi)
+        key = self.cache.key_for_file(path, *params)
+        if self.cache.contains(key):
+            return
+
+        with self._lock:
+            if path in self._pending:
+                return
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                self._owns_executor = True
+            done = threading.Event()
+            future = self._executor.submit(_prepare_image_task, (path,) + params, self.max_decode_bytes)
+            self._pending[path] = (future, done)
+
+        def store(future):
+            try:
+                if not future.cancelled():
+                    result, error, timings = future.result()
+                    if self.on_timings is not None:
+                        self.on_timings(timings)
+                    if error is None:
+                        self.cache.put(key, result)
+                    else:
+                        logger.warning(f"Background preprocessing failed for {path}: {error}")
+            finally:
+                with self._lock:
+                    self._pending.pop(path, None)
+                done.set()
+
+        future.add_done_callback(store)
+
+    def wait(self, paths, timeout=None):
+        """
+        Make sure no background work is outstanding for paths.
+
+        Jobs that have not started are cancelled so the caller can compute
+        them inline; jobs already running are waited for.
+        """
+        with self._lock:
+            entries = [self._pending[path] for path in paths if path in self._pending]
+        for future, _ in entries:
+            future.cancel()
+        for _, done in entries:
+            done.wait(timeout)
+
+    def discard(self, path):
+        """Cancel queued work for a path that is no longer needed"""
+        with self._lock:
+            entry = self._pending.get(path)
+        if entry is not None:
+            entry[0].cancel()
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+            entries = list(self._pending.values())
+        if executor is not None and self._owns_executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+        else:
+            for future, _ in entries:
+                future.cancel()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Header-only image probing and decode memory estimates.
+
+Image.open only parses the file header, so dimensions, mode and frame count
+are known before any pixel buffer is allocated. From those the memory a
+decode will need can be estimated, letting callers reject decompression
+bombs and images over their memory budget up front, or decode JPEGs at a
+reduced DCT scale instead.
+"""
+
+import math
+import warnings
+from PIL import Image
+
+# Pillow's own decompression bomb threshold; larger images are rejected outright
+MAX_IMAGE_PIXELS = Image.MAX_IMAGE_PIXELS
+
+# Scales libjpeg can decode at directly in the DCT domain
+JPEG_DRAFT_SCALES = (8, 4, 2, 1)
+
+# Converting to RGB or RGBA allocates a second buffer of 4 bytes per pixel
+CONVERTED_BYTES_PER_PIXEL = 4
+
+# The pixel limit is enforced by check_pixel_limit with a clear error instead. Set once
+# here: warnings.catch_warnings changes global state and is not safe in threads.
+warnings.filterwarnings('ignore', category=Image.DecompressionBombWarning)
+
+
+class ImageTooLargeError(Exception):
+    """Raised when decoding an image would exceed the pixel limit or memory budget"""
+
+
+class ImageProbe:
+    """Format, mode, size and frame count of an image, read from its header"""
+
+    def __init__(self, image_format, mode, width, height, frames=1):
+        self.format = image_format
+        self.mode = mode
+        self.width = width
+        self.height = height
+        self.frames = frames
+
+
+def probe_image(source):
+    """
+    Probe a path or file object without decoding pixel data.
+    Raises ImageTooLargeError for decompression bombs and OSError or
+    SyntaxError-derived errors for files Pillow cannot identify.
+    """
+    try:
+        with Image.open(source) as img:
+            try:
+                # GIF and APNG count frames by skipping blocks, without decoding them
+                frames = getattr(img, 'n_frames', 1)
+            except Exception:
+                frames = None  # Header data ends before the frame count is known
+            probe = ImageProbe(img.format, img.mode, img.width, img.height, frames)
+    except Image.DecompressionBombError as e:
+        raise ImageTooLargeError(str(e))
+    check_pixel_limit(probe.width, probe.height)
+    return probe
+
+
+def check_pixel_limit(width, height):
+    if width * height > MAX_IMAGE_PIXELS:
+        raise ImageTooLargeError(f"{width}x{height} pixels exceeds the limit of {MAX_IMAGE_PIXELS} pixels")
+
+
+def bytes_per_pixel(mode):
+    """Bytes Pillow stores per pixel; multi-band 8-bit modes are padded to 4 bytes"""
+    if mode in ('1', 'L', 'P'):
+        return 1
+    if mode.startswith('I;16'):
+        return 2
+    return 4
+
+
+def jpeg_draft_size(width, height, requested_size):
+    """Size libjpeg decodes at when asked for at least requested_size, as Image.draft picks it"""
+    # Sources smaller than twice the requested size are decoded at full size
+    scale = max(1, min(width // requested_size[0], height // requested_size[1]))
+    scale = next(s for s in JPEG_DRAFT_SCALES if scale >= s)
+    return math.ceil(width / scale), math.ceil(height / scale)
+
+
+def estimate_decode_bytes(mode, width, height, converts=False):
+    """Peak memory for decoding a width x height image in mode, plus an optional conversion"""
+    estimate = width * height * bytes_per_pixel(mode)
+    if converts:
+        estimate += width * height * CONVERTED_BYTES_PER_PIXEL
+    return estimate
+
+
+def check_decodable(probe, max_decode_bytes):
+    """
+    Raise ImageTooLargeError if even the smallest possible decode of the probed
+    image exceeds max_decode_bytes: 1/8 scale for JPEGs, full size otherwise.
+    """
+    width, height = probe.width, probe.height
+    if probe.format == 'JPEG':
+        width, height = jpeg_draft_size(width, height, (1, 1))
+    needed = estimate_decode_bytes(probe.mode, width, height)
+    if needed > max_decode_bytes:
+        raise ImageTooLargeError(f"decoding {probe.width}x{probe.height} {probe.mode} needs "
+                                 f"{needed / 2**20:.1f} MB, more than the {max_decode_bytes / 2**20:.1f} MB budget")
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+In-process metrics in the Prometheus text exposition format.
+
+Counters and histograms keep their values in plain dicts guarded by a lock,
+so recording a value costs a lookup and an addition; nothing is formatted
+until the /metrics endpoint is scraped. Gauges are read from a callback at
+scrape time.
+"""
+
+import abc
+import bisect
+import threading
+
+# Upper bounds in seconds, from per-image stages to whole reports
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+               for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class Metric(abc.ABC):
+    """Common part of all metric types: name, help text and label names"""
+
+    type_name = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if len(labels) != len(self.labels):
+            raise ValueError(f"{self.name} takes labels {self.labels}, got {labels}")
+        return tuple(labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}",
+                 f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self._samples())
+        return '\n'.join(lines)
+
+    @abc.abstractmethod
+    def _samples(self):
+        """Sample lines of the metric in the exposition format"""
+
+
+class Counter(Metric):
+    """Monotonically increasing count per label combination"""
+
+    type_name = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        super().__init__(name, documentation, labels)
+        self._values = {}
+
+    def inc(self, *labels, amount=1):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+                for key, value in values]
+
+
+class Histogram(Metric):
+    """Distribution of observed values in cumulative buckets, with sum and count"""
+
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # labels -> [bucket counts..., sum, count]
+
+    def observe(self, value, *labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                entry[index] += 1
+            entry[-2] += value
+            entry[-1] += 1
+
+    def _samples(self):
+        with self._lock:
+            values = sorted((key, list(entry)) for key, entry in self._values.items())
+        samples = []
+        for key, entry in values:
+            # Bucket counts are stored per bucket and exposed cumulatively
+            cumulative = 0
+            for bound, count in zip(self.buckets, entry):
+                cumulative += count
+                labels = _format_labels(self.labels, key, [('le', _format_value(float(bound)))])
+                samples.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, key, [('le', '+Inf')])
+            samples.append(f"{self.name}_bucket{labels} {entry[-1]}")
+            labels = _format_labels(self.labels, key)
+            samples.append(f"{self.name}_sum{labels} {_format_value(entry[-2])}")
+            samples.append(f"{self.name}_count{labels} {entry[-1]}")
+        return samples
+
+
+class Gauge(Metric):
+    """Current values read from a callback when the metrics are rendered"""
+
+    type_name = 'gauge'
+
+    def __init__(self, name, documentation, read, labels=()):
+        super().__init__(name, documentation, labels)
+        self.read = read  # Returns {label values tuple: value}
+
+    def _samples(self):
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+                for key, value in sorted(self.read().items())]
+
+
+class MetricsRegistry:
+    """Metrics rendered together by one /metrics endpoint"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labels=()):
+        return self.register(Counter(name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def gauge(self, name, documentation, read, labels=()):
+        return self.register(Gauge(name, documentation, read, labels))
+
+    def render(self):
+        return '\n'.join(metric.render() for metric in self._metrics) + '\n'
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Reusable page chrome for the generated PDFs.
+
+The logo is decoded once per process and kept as a ready ImageReader, and
+static page elements are emitted once per document as form XObjects that
+every page references instead of repeating the drawing operations.
+"""
+
+import os
+import logging
+from functools import lru_cache
+from PIL import Image
+from reportlab.lib.utils import ImageReader
+from image_pipeline import target_pixel_size
+
+logger = logging.getLogger(__name__)
+
+# Resolution the logo is kept at, relative to the largest size it is drawn
+LOGO_DPI = 300
+
+
+@lru_cache(maxsize=4)
+def _load_logo(logo_path, mtime_ns, max_width, max_height, dpi):
+    with Image.open(logo_path) as img:
+        img.thumbnail(target_pixel_size(max_width, max_height, dpi))
+        img.load()
+        logo = img.copy()
+    reader = ImageReader(logo)
+    # Decode and split the alpha channel now so every document reuses the result
+    reader.getRGBData()
+    return reader
+
+
+def get_logo(logo_path, max_width, max_height, dpi=LOGO_DPI):
+    """
+    ImageReader for the logo scaled for drawing at up to max_width x max_height
+    points, or None if the logo does not exist. Cached until the file changes.
+    """
+    try:
+        mtime_ns = os.stat(logo_path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    return _load_logo(logo_path, mtime_ns, max_width, max_height, dpi)
+
+
+def stamp_form(c, name, draw):
+    """
+    Draw the form XObject `name` on the current page. The first use in a
+    document records draw(c) as the form; later pages only reference it.
+    """
+    if not c.hasForm(name):
+        c.beginForm(name)
+        draw(c)
+        c.endForm()
+    c.doForm(name)
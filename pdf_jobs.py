@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Bounded background queue for PDF generation jobs.
+
+Jobs run on a fixed-size thread pool and report progress while they render.
+The number of queued plus running jobs is capped, so a burst of requests is
+rejected instead of starting an unbounded number of concurrent renders.
+Jobs submitted with a key are coalesced: while a job with that key is queued
+or running, submitting the same key again returns the existing job.
+"""
+
+import time
+import secrets
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+FINISHED_STATES = (JOB_DONE, JOB_FAILED)
+
+
+class QueueFullError(Exception):
+    """Raised when the queue already holds its maximum number of jobs"""
+
+
+class PDFJob:
+    """State of a single PDF generation job"""
+
+    def __init__(self, owner, images_total, key=None):
+        self.id = secrets.token_hex(16)
+        self.owner = owner
+        self.key = key
+        self.status = JOB_QUEUED
+        self.images_total = images_total
+        self.images_processed = 0
+        self.images_failed = 0  # Left out of the PDF as invalid or undecodable
+        self.pages = 0
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.version = 0  # Incremented on every change, used by waiters
+        self._changed = threading.Condition()
+
+    def _update(self, **changes):
+        with self._changed:
+            for name, value in changes.items():
+                setattr(self, name, value)
+            self.version += 1
+            self._changed.notify_all()
+
+    def report_progress(self, images_processed, pages, images_failed=0):
+        """Progress callback handed to the PDF generator"""
+        self._update(images_processed=images_processed, pages=pages, images_failed=images_failed)
+
+    def wait_for_change(self, version, timeout=None):
+        """Block until the job changes after `version`; returns the new version"""
+        with self._changed:
+            self._changed.wait_for(lambda: self.version != version, timeout)
+            return self.version
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATES
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'images_total': self.images_total,
+            'images_processed': self.images_processed,
+            'images_failed': self.images_failed,
+            'pages': self.pages,
+            'error': self.error,
+        }
+
+
+class PDFJobQueue:
+    """Runs PDF jobs on a bounded worker pool and keeps recent jobs for lookup"""
+
+    def __init__(self, workers=2, max_queued=8, retention=3600):
+        self.max_jobs = workers + max_queued
+        self.retention = retention
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='pdf-job')
+        self._jobs = {}
+        self._active_by_key = {}
+        self._active = 0
+        self._lock = threading.Lock()
+
+    def submit(self, owner, images_total, render, key=None):
+        """
+        Queue render(job) for execution and return the job.
+        render reports progress through job.report_progress and returns the
+        job result; exceptions mark the job as failed. If a job with the same
+        key is still queued or running, that job is returned instead.
+        """
+        with self._lock:
+            if key is not None and key in self._active_by_key:
+                return self._active_by_key[key]
+            self._prune()
+            if self._active >= self.max_jobs:
+                raise QueueFullError(f"{self._active} PDF jobs already queued or running")
+            job = PDFJob(owner, images_total, key)
+            self._jobs[job.id] = job
+            if key is not None:
+                self._active_by_key[key] = job
+            self._active += 1
+
+        self._executor.submit(self._run, job, render)
+        return job
+
+    def _run(self, job, render):
+        job._update(status=JOB_RUNNING)
+        try:
+            result = render(job)
+            if result is None:
+                job._update(status=JOB_FAILED, error='PDF generation failed',
+                            finished_at=time.time())
+            else:
+                job._update(status=JOB_DONE, result=result, finished_at=time.time())
+        except Exception as e:
+            logger.error(f"PDF job {job.id} failed: {e}")
+            job._update(status=JOB_FAILED, error=str(e), finished_at=time.time())
+        finally:
+            with self._lock:
+                self._active -= 1
+                if job.key is not None:
+                    self._active_by_key.pop(job.key, None)
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def active_count(self):
+        """Number of jobs queued or running"""
+        with self._lock:
+            return self._active
+
+    def _prune(self):
+        """Forget finished jobs older than the retention period"""
+        cutoff = time.time() - self.retention
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished and job.finished_at < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
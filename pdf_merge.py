@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Streaming concatenation of PDF files produced by ReportLab.
+
+Pages from each input are copied object by object straight to the output
+file, so only one input document is held in memory at a time. Form fields
+from all inputs are combined into a single AcroForm; field names must
+already be unique across inputs.
+
+Every input carries its own copy of the images and forms drawn on all
+pages, such as the header logo. Image and form XObjects are identified by
+a digest of their data, dictionary and the XObjects they use, and are
+written only once; later inputs refer to the first copy.
+"""
+
+import gc
+import hashlib
+import logging
+from pypdf import PdfReader
+from pypdf.generic import (
+    ArrayObject, DictionaryObject, IndirectObject, NameObject, NumberObject,
+    StreamObject, EncodedStreamObject, DecodedStreamObject,
+)
+
+logger = logging.getLogger(__name__)
+
+# XObject subtypes written once when several inputs contain identical copies
+SHARED_XOBJECT_SUBTYPES = ('/Image', '/Form')
+
+# Object numbers reserved for the objects written at the end
+CATALOG_NUMBER = 1
+PAGES_NUMBER = 2
+ACROFORM_NUMBER = 3
+INFO_NUMBER = 4
+FIRST_FREE_NUMBER = 5
+
+
+class StreamingPDFWriter:
+    """Write pages of several PDFs into one output stream as they are read"""
+
+    def __init__(self, output):
+        self.output = output
+        self._offsets = {}
+        self._next_number = FIRST_FREE_NUMBER
+        self._page_numbers = []
+        self._field_numbers = []
+        self._acroform_extra = None
+        self._info = None
+        self._mapping = None
+        self._queue = None
+        self._reader = None
+        self._inputs = 0
+        self._descriptions = None  # Input object number -> content description, for the current input
+        self._shared = {}  # Content digest -> output object number of shared XObjects
+        self.output.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def _reference(self, ref):
+        """New reference for an object of the current input, queueing it for copying"""
+        number = self._mapping.get(ref.idnum)
+        if number is None:
+            digest = self._xobject_digest(ref)
+            number = self._shared.get(digest) if digest is not None else None
+            if number is None:
+                number = self._next_number
+                self._next_number += 1
+                self._queue.append(ref)
+                if digest is not None:
+                    self._shared[digest] = number
+            self._mapping[ref.idnum] = number
+        return IndirectObject(number, 0, None)
+
+    def _xobject_digest(self, ref):
+        """Content digest of an image or form XObject of the current input, None for other objects"""
+        obj = self._reader.get_object(ref)
+        if isinstance(obj, StreamObject) and obj.get('/Subtype') in SHARED_XOBJECT_SUBTYPES:
+            return self._describe(ref)
+        return None
+
+    def _describe(self, ref):
+        """
+        Text identifying an object of the current input by content: a digest
+        for XObjects, the canonical text for other dictionaries and arrays
+        """
+        if ref.idnum in self._descriptions:
+            return self._descriptions[ref.idnum]
+        unique = f"ref{self._inputs}:{ref.idnum}"
+        self._descriptions[ref.idnum] = unique  # Breaks reference cycles
+        obj = self._reader.get_object(ref)
+        if isinstance(obj, StreamObject):
+            if obj.get('/Subtype') not in SHARED_XOBJECT_SUBTYPES:
+                return unique
+            hasher = hashlib.sha256(obj._data)
+            hasher.update(self._canonical(obj).encode('utf-8'))
+            description = hasher.hexdigest()
+        elif isinstance(obj, ArrayObject) or (isinstance(obj, DictionaryObject) and obj.get('/Type') != '/Page'):
+            description = self._canonical(obj)
+        else:
+            # Pages and the rest make a referencing XObject unique to its input
+            return unique
+        self._descriptions[ref.idnum] = description
+        return description
+
+    def _canonical(self, obj):
+        """Text describing obj with references replaced by the description of their target"""
+        if isinstance(obj, IndirectObject):
+            return self._describe(obj)
+        if isinstance(obj, DictionaryObject):
+            return '<<' + ' '.join(f"{key} {self._canonical(value)}"
+                                   for key, value in sorted(obj.items())) + '>>'
+        if isinstance(obj, ArrayObject):
+            return '[' + ' '.join(self._canonical(item) for item in obj) + ']'
+        return repr(obj)
+
+    def _copy(self, obj):
+        """Copy obj with every indirect reference renumbered for the output"""
+        if isinstance(obj, IndirectObject):
+            return self._reference(obj)
+        if isinstance(obj, StreamObject):
+            copy = EncodedStreamObject() if '/Filter' in obj else DecodedStreamObject()
+            copy._data = obj._data
+        elif isinstance(obj, DictionaryObject):
+            copy = DictionaryObject()
+        elif isinstance(obj, ArrayObject):
+            return ArrayObject(self._copy(item) for item in obj)
+        else:
+            return obj
+
+        for key, value in obj.items():
+            copy[NameObject(key)] = self._copy(value)
+        if copy.get('/Type') == '/Page':
+            copy[NameObject('/Parent')] = IndirectObject(PAGES_NUMBER, 0, None)
+        return copy
+
+    def _write_object(self, number, obj):
+        self._offsets[number] = self.output.tell()
+        self.output.write(f"{number} 0 obj\n".encode('ascii'))
+        obj.write_to_stream(self.output)
+        self.output.write(b"\nendobj\n")
+
+    def add_document(self, reader):
+        """Append all pages and form fields of a PdfReader"""
+        root = reader.trailer['/Root'].get_object()
+        self._mapping = {}
+        self._queue = []
+        self._reader = reader
+        self._inputs += 1
+        self._descriptions = {}
+
+        # The input's own page tree and catalog are replaced by ours
+        pages_ref = root.raw_get('/Pages')
+        if isinstance(pages_ref, IndirectObject):
+            self._mapping[pages_ref.idnum] = PAGES_NUMBER
+        catalog_ref = reader.trailer.raw_get('/Root')
+        if isinstance(catalog_ref, IndirectObject):
+            self._mapping[catalog_ref.idnum] = CATALOG_NUMBER
+
+        for page in reader.pages:
+            self._page_numbers.append(self._reference(page.indirect_reference).idnum)
+
+        acroform = root.get('/AcroForm')
+        if acroform is not None:
+            acroform = acroform.get_object()
+            for field in acroform.get('/Fields', []):
+                self._field_numbers.append(self._reference(field).idnum)
+            if self._acroform_extra is None:
+                self._acroform_extra = {key: self._copy(value) for key, value in acroform.items()
+                                        if key != '/Fields'}
+
+        if self._info is None and '/Info' in reader.trailer:
+            self._info = self._copy(reader.trailer['/Info'].get_object())
+
+        while self._queue:
+            ref = self._queue.pop()
+            self._write_object(self._mapping[ref.idnum], self._copy(reader.get_object(ref)))
+
+        self._mapping = None
+        self._queue = None
+        self._reader = None
+        self._descriptions = None
+
+    def finish(self):
+        """Write the page tree, form, catalog and cross-reference table"""
+        def refs(numbers):
+            return ArrayObject(IndirectObject(number, 0, None) for number in numbers)
+
+        pages = DictionaryObject({
+            NameObject('/Type'): NameObject('/Pages'),
+            NameObject('/Kids'): refs(self._page_numbers),
+            NameObject('/Count'): NumberObject(len(self._page_numbers)),
+        })
+        self._write_object(PAGES_NUMBER, pages)
+
+        catalog = DictionaryObject({
+            NameObject('/Type'): NameObject('/Catalog'),
+            NameObject('/Pages'): IndirectObject(PAGES_NUMBER, 0, None),
+        })
+        if self._acroform_extra is not None or self._field_numbers:
+            acroform = DictionaryObject({NameObject(key): value
+                                         for key, value in (self._acroform_extra or {}).items()})
+            acroform[NameObject('/Fields')] = refs(self._field_numbers)
+            self._write_object(ACROFORM_NUMBER, acroform)
+            catalog[NameObject('/AcroForm')] = IndirectObject(ACROFORM_NUMBER, 0, None)
+        self._write_object(CATALOG_NUMBER, catalog)
+
+        if self._info is not None:
+            self._write_object(INFO_NUMBER, self._info)
+
+        size = self._next_number
+        xref_offset = self.output.tell()
+        self.output.write(f"xref\n0 {size}\n".encode('ascii'))
+        self.output.write(b"0000000000 65535 f \n")
+        for number in range(1, size):
+            offset = self._offsets.get(number)
+            if offset is None:
+                self.output.write(b"0000000000 65535 f \n")
+            else:
+                self.output.write(f"{offset:010d} 00000 n \n".encode('ascii'))
+
+        trailer = f"trailer\n<< /Size {size} /Root {CATALOG_NUMBER} 0 R"
+        if self._info is not None:
+            trailer += f" /Info {INFO_NUMBER} 0 R"
+        trailer += f" >>\nstartxref\n{xref_offset}\n%%EOF\n"
+        self.output.write(trailer.encode('ascii'))
+
+
+def merge_pdfs(input_paths, output_path):
+    """Concatenate input_paths into output_path, one input in memory at a time"""
+    with open(output_path, 'wb') as output:
+        writer = StreamingPDFWriter(output)
+        for path in input_paths:
+            with open(path, 'rb') as part:
+                writer.add_document(PdfReader(part))
+            # pypdf objects reference their reader; free each input before the next
+            gc.collect()
+        writer.finish()
+    logger.info(f"Merged {len(input_paths)} PDF parts into {output_path}")
+    return output_path
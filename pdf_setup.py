@@ -0,0 +1,17 @@
+#!/usr/bin/env python3
+"""
+ReportLab settings shared by the command line and web versions.
+
+ReportLab reads these from its global rl_config while a document is saved,
+so they cannot be set per canvas. The applications call configure_reportlab()
+once at startup, before any canvas is created.
+"""
+
+from reportlab import rl_config
+
+
+def configure_reportlab():
+    # Write PDF streams as binary. ReportLab's default ASCII85 encoding makes every
+    # embedded JPEG a quarter larger and is computed in pure Python. The size
+    # budget's estimates of embedded image sizes assume binary streams as well.
+    rl_config.useA85 = 0
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Process memory measurements used to report the footprint of PDF rendering.
+"""
+
+import os
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+# Seconds between scans for child processes; finding them means listing /proc
+CHILDREN_SAMPLE_INTERVAL = 0.5
+
+
+def current_rss_bytes():
+    """Resident set size of this process right now, or None if unknown"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return peak_rss_bytes()
+
+
+def peak_rss_bytes():
+    """Highest resident set size this process has reached, or None if unknown"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def children_rss_bytes():
+    """Combined resident set size of this process's children, such as pool workers, or None if unknown"""
+    pid = os.getpid()
+    try:
+        entries = os.listdir('/proc')
+    except OSError:
+        return None
+    total = 0
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                # The parent pid follows the state, after the parenthesised command name
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+            if ppid != pid:
+                continue
+            with open(f'/proc/{entry}/statm') as f:
+                total += int(f.read().split()[1]) * _PAGE_SIZE
+        except (OSError, ValueError, IndexError):
+            continue  # Exited while /proc was listed
+    return total
+
+
+class PeakMemoryTracker:
+    """
+    Track the highest RSS seen at explicit sample points, for this process
+    and for its child processes together. Pool workers are children, and
+    images are decoded there. Shared pools also work for other jobs at the
+    same time, so the children's peak is an upper bound for a single job.
+    """
+
+    def __init__(self):
+        self.peak = None
+        self.children_peak = None
+        self._children_sampled_at = None
+        self.sample()
+
+    def sample(self):
+        rss = current_rss_bytes()
+        if rss is not None and (self.peak is None or rss > self.peak):
+            self.peak = rss
+        now = time.monotonic()
+        if self._children_sampled_at is None or now - self._children_sampled_at >= CHILDREN_SAMPLE_INTERVAL:
+            self._sample_children()
+        return rss
+
+    def _sample_children(self):
+        self._children_sampled_at = time.monotonic()
+        children = children_rss_bytes()
+        if children is not None and (self.children_peak is None or children > self.children_peak):
+            self.children_peak = children
+
+    def format_peak(self):
+        # Scans are throttled; include the workers as they are now
+        self._sample_children()
+        if self.peak is None:
+            return "unknown"
+        text = f"{self.peak / (1024 * 1024):.1f} MB"
+        if self.children_peak:
+            text += f" in this process, {self.children_peak / (1024 * 1024):.1f} MB in worker processes"
+        return text
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Server-side session data for the web version.
+
+A session holds its creation time and the list of images uploaded in it.
+Sessions expire after a period without access (TTL) and the least recently
+used sessions are evicted once the store holds more than max_sessions.
+
+MemorySessionStore keeps everything in the process. SQLiteSessionStore keeps
+it in a local database file, so sessions survive a restart of the app. The
+rest of the web app (PDF jobs, blob references, cleanup) is kept per
+process, so the app runs as a single process either way.
+"""
+
+import abc
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+
+DEFAULT_TTL = 24 * 3600  # Seconds without access before a session expires
+DEFAULT_MAX_SESSIONS = 10000
+
+
+class SessionStore(abc.ABC):
+    """Interface shared by the session store backends"""
+
+    def __init__(self, ttl=DEFAULT_TTL, max_sessions=DEFAULT_MAX_SESSIONS):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+
+    @abc.abstractmethod
+    def ensure(self, session_id):
+        """Create the session if it does not exist and mark it as used"""
+
+    @abc.abstractmethod
+    def get(self, session_id):
+        """{'created_at': ..., 'images': [...]} for a live session, or None"""
+
+    @abc.abstractmethod
+    def add_image(self, session_id, image):
+        """Append an image record to an existing session"""
+
+    @abc.abstractmethod
+    def remove_image(self, session_id, filename):
+        """Remove the image records with the given filename"""
+
+    @abc.abstractmethod
+    def purge_expired(self):
+        """Drop expired sessions; returns how many were removed"""
+
+
+class MemorySessionStore(SessionStore):
+    """Sessions in a dict local to this process"""
+
+    def __init__(self, ttl=DEFAULT_TTL, max_sessions=DEFAULT_MAX_SESSIONS):
+        super().__init__(ttl, max_sessions)
+        self._sessions = OrderedDict()  # Least recently used first
+        self._lock = threading.Lock()
+
+    def _live(self, session_id, now):
+        entry = self._sessions.get(session_id)
+        if entry is None:
+            return None
+        if now - entry['last_access'] > self.ttl:
+            del self._sessions[session_id]
+            return None
+        entry['last_access'] = now
+        self._sessions.move_to_end(session_id)
+        return entry
+
+    def ensure(self, session_id):
+        now = time.time()
+        with self._lock:
+            if self._live(session_id, now) is None:
+                self._sessions[session_id] = {
+                    'created_at': now,
+                    'last_access': now,
+                    'images': [],
+                }
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+
+    def get(self, session_id):
+        with self._lock:
+            entry = self._live(session_id, time.time())
+            if entry is None:
+                return None
+            return {'created_at': entry['created_at'],
+                    'images': [dict(image) for image in entry['images']]}
+
+    def add_image(self, session_id, image):
+        with self._lock:
+            entry = self._live(session_id, time.time())
+            if entry is not None:
+                entry['images'].append(dict(image))
+
+    def remove_image(self, session_id, filename):
+        with self._lock:
+            entry = self._live(session_id, time.time())
+            if entry is not None:
+                entry['images'] = [image for image in entry['images']
+                                   if image['filename'] != filename]
+
+    def purge_expired(self):
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            expired = [session_id for session_id, entry in self._sessions.items()
+                       if entry['last_access'] < cutoff]
+            for session_id in expired:
+                del self._sessions[session_id]
+        return len(expired)
+
+
+class SQLiteSessionStore(SessionStore):
+    """Sessions in a SQLite database file, kept across restarts"""
+
+    def __init__(self, db_path, ttl=DEFAULT_TTL, max_sessions=DEFAULT_MAX_SESSIONS):
+        super().__init__(ttl, max_sessions)
+        self.db_path = db_path
+        self._local = threading.local()
+        with self._connect() as db:
+            db.executescript("""
+                CREATE TABLE IF NOT EXISTS sessions (
+                    id TEXT PRIMARY KEY,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS sessions_last_access ON sessions (last_access);
+                CREATE TABLE IF NOT EXISTS session_images (
+                    position INTEGER PRIMARY KEY AUTOINCREMENT,
+                    session_id TEXT NOT NULL REFERENCES sessions (id) ON DELETE CASCADE,
+                    filename TEXT NOT NULL,
+                    data TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS session_images_session ON session_images (session_id);
+            """)
+
+    def _connect(self):
+        """One connection per thread; SQLite connections are not shared between threads"""
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.db_path, timeout=30)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA foreign_keys=ON")
+            self._local.db = db
+        return db
+
+    def _touch(self, db, session_id, now):
+        """Mark a live session as used; returns False if it is missing or expired"""
+        cursor = db.execute("UPDATE sessions SET last_access = ? WHERE id = ? AND last_access >= ?",
+                            (now, session_id, now - self.ttl))
+        return cursor.rowcount > 0
+
+    def ensure(self, session_id):
+        now = time.time()
+        with self._connect() as db:
+            if self._touch(db, session_id, now):
+                return
+            # Expired sessions are replaced by a fresh one
+            db.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+            db.execute("INSERT INTO sessions (id, created_at, last_access) VALUES (?, ?, ?)",
+                       (session_id, now, now))
+            db.execute("""
+                DELETE FROM sessions WHERE id IN (
+                    SELECT id FROM sessions ORDER BY last_access DESC LIMIT -1 OFFSET ?
+                )""", (self.max_sessions,))
+
+    def get(self, session_id):
+        with self._connect() as db:
+            if not self._touch(db, session_id, time.time()):
+                return None
+            created_at, = db.execute("SELECT created_at FROM sessions WHERE id = ?",
+                                     (session_id,)).fetchone()
+            rows = db.execute("SELECT data FROM session_images WHERE session_id = ? ORDER BY position",
+                              (session_id,)).fetchall()
+        return {'created_at': created_at, 'images': [json.loads(data) for data, in rows]}
+
+    def add_image(self, session_id, image):
+        with self._connect() as db:
+            if self._touch(db, session_id, time.time()):
+                db.execute("INSERT INTO session_images (session_id, filename, data) VALUES (?, ?, ?)",
+                           (session_id, image['filename'], json.dumps(image)))
+
+    def remove_image(self, session_id, filename):
+        with self._connect() as db:
+            if self._touch(db, session_id, time.time()):
+                db.execute("DELETE FROM session_images WHERE session_id = ? AND filename = ?",
+                           (session_id, filename))
+
+    def purge_expired(self):
+        with self._connect() as db:
+            cursor = db.execute("DELETE FROM sessions WHERE last_access < ?",
+                                (time.time() - self.ttl,))
+        return cursor.rowcount
+
+
+def create_session_store(backend, db_path=None, ttl=DEFAULT_TTL, max_sessions=DEFAULT_MAX_SESSIONS):
+    """Session store for a backend name: 'memory' or 'sqlite'"""
+    if backend == 'memory':
+        return MemorySessionStore(ttl, max_sessions)
+    if backend == 'sqlite':
+        return SQLiteSessionStore(db_path, ttl, max_sessions)
+    raise ValueError(f"Unknown session store backend: {backend}")
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Fit generated PDFs under a byte budget.
+
+The PDF is first rendered with the usual derivatives. If it is too large,
+everything except the images is measured as overhead, and each image gets
+an encoding from a ladder of levels (JPEG quality, then resolution) so the
+images together fit in what is left. All images share one level where
+possible; leftover bytes then buy individual images the level above.
+Screenshot-like PNG, GIF and BMP sources are embedded losslessly whenever
+that is no larger than the JPEG at the same level. Encoded attempts are
+kept, so the search never encodes an image twice at the same level.
+"""
+
+import os
+import re
+import zlib
+import logging
+from io import BytesIO
+from PIL import Image
+from image_pipeline import load_thumbnail, target_pixel_size
+
+logger = logging.getLogger(__name__)
+
+# (resolution scale, JPEG quality) from best to smallest; level 0 is the unchanged derivative
+LEVELS = ((1.0, None), (1.0, 75), (1.0, 65), (1.0, 55), (0.85, 50), (0.7, 45),
+          (0.6, 40), (0.5, 35), (0.4, 30), (0.3, 25))
+
+# Sources that may compress better losslessly than as JPEG
+LOSSLESS_FORMATS = ('PNG', 'GIF', 'BMP')
+
+MAX_PASSES = 4  # Renders before giving up on reaching the budget
+SLACK_PER_IMAGE = 32  # Bytes kept free per image for image dictionary differences between levels
+
+SIZE_UNITS = {'': 1, 'B': 1, 'K': 1024, 'KB': 1024, 'M': 1024 ** 2, 'MB': 1024 ** 2,
+              'G': 1024 ** 3, 'GB': 1024 ** 3}
+
+
+def parse_size(text):
+    """Bytes from a size such as '10MB', '9.5M', '800KB' or '2000000'"""
+    match = re.fullmatch(r'\s*([0-9]+(?:\.[0-9]+)?)\s*([a-zA-Z]*)\s*', str(text))
+    if not match or match.group(2).upper() not in SIZE_UNITS:
+        raise ValueError(f"Invalid size: {text}")
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).upper()])
+
+
+def _scaled(img, scale):
+    if scale == 1.0:
+        return img
+    size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+    return img.resize(size, Image.LANCZOS)
+
+
+class BudgetImage:
+    """Encoded attempts of one image at the budget levels"""
+
+    def __init__(self, source_path, derivative, thumbnail_size, max_decode_bytes=None):
+        self.source_path = source_path
+        self.derivative = derivative  # (jpeg_bytes, width, height) as rendered normally
+        self.thumbnail_size = thumbnail_size
+        self.max_decode_bytes = max_decode_bytes
+        self._jpeg = {0: derivative[0]}  # level -> JPEG bytes
+        self._lossless = {}  # scale -> (PNG bytes, embedded size)
+        self._lossless_source = None  # PNG bytes of the RGB thumbnail, or False if not applicable
+
+    def _lossless_candidate(self, scale):
+        """(PNG bytes, size in the PDF) for a lossless encoding at scale, or None"""
+        if self._lossless_source is None:
+            self._lossless_source = False
+            try:
+                with Image.open(self.source_path) as img:
+                    lossless = img.format in LOSSLESS_FORMATS
+                if lossless:
+                    buffer = BytesIO()
+                    load_thumbnail(self.source_path, self.thumbnail_size,
+                                   max_decode_bytes=self.max_decode_bytes).save(buffer, format='PNG',
+                                                                                compress_level=1)
+                    self._lossless_source = buffer.getvalue()
+            except Exception as e:
+                logger.warning(f"No lossless candidate for {self.source_path}: {e}")
+        if not self._lossless_source:
+            return None
+
+        if scale not in self._lossless:
+            with Image.open(BytesIO(self._lossless_source)) as img:
+                img = _scaled(img.convert('RGB'), scale)
+                buffer = BytesIO()
+                img.save(buffer, format='PNG', compress_level=1)
+                # ReportLab embeds non-JPEG images as zlib-compressed RGB data
+                self._lossless[scale] = buffer.getvalue(), len(zlib.compress(img.tobytes()))
+        return self._lossless[scale]
+
+    def _jpeg_at(self, level):
+        if level not in self._jpeg:
+            scale, quality = LEVELS[level]
+            with Image.open(BytesIO(self.derivative[0])) as img:
+                img = _scaled(img.convert('RGB'), scale)
+                buffer = BytesIO()
+                img.save(buffer, format='JPEG', quality=quality, optimize=True)
+            self._jpeg[level] = buffer.getvalue()
+        return self._jpeg[level]
+
+    def encoding(self, level):
+        """(image bytes, size in the PDF) at a level; lossless wins when it is no larger"""
+        jpeg = self._jpeg_at(level)
+        lossless = self._lossless_candidate(LEVELS[level][0])
+        if lossless is not None and lossless[1] <= len(jpeg):
+            return lossless
+        return jpeg, len(jpeg)
+
+    def size(self, level):
+        return self.encoding(level)[1]
+
+    def result(self, level):
+        """Prepared result in the form iter_prepared_images yields it"""
+        _, width, height = self.derivative
+        return self.encoding(level)[0], width, height
+
+
+def choose_levels(images, image_budget):
+    """Level per image so the images together take at most image_budget bytes, best effort"""
+    worst = len(LEVELS) - 1
+
+    def total(level):
+        return sum(image.size(level) for image in images)
+
+    # Lowest common level that fits; image sizes shrink with every level
+    low, high = 0, worst
+    if total(worst) > image_budget:
+        logger.warning(f"Images need at least {total(worst)} bytes, more than the {image_budget} available")
+        return [worst] * len(images)
+    while low < high:
+        middle = (low + high) // 2
+        if total(middle) <= image_budget:
+            high = middle
+        else:
+            low = middle + 1
+    levels = [low] * len(images)
+
+    # Spend the rest on moving images one level up, cheapest upgrades first
+    if low > 0:
+        remaining = image_budget - total(low)
+        costs = sorted((image.size(low - 1) - image.size(low), i) for i, image in enumerate(images))
+        for cost, i in costs:
+            if cost > remaining:
+                break
+            levels[i] = low - 1
+            remaining -= cost
+    return levels
+
+
+class SizeBudget:
+    """Renders a PDF under max_bytes by re-encoding its images"""
+
+    def __init__(self, max_bytes, max_width, max_height, dpi, max_decode_bytes=None):
+        self.max_bytes = max_bytes
+        self.thumbnail_size = target_pixel_size(max_width, max_height, dpi)
+        self.max_decode_bytes = max_decode_bytes
+
+    def render(self, render, output_pdf):
+        """
+        Run render(prepared_hook, first_pass) until output_pdf fits the budget.
+        render passes prepared_hook(source_paths, prepared_images) to the PDF
+        generator, which draws the (result, error) pairs the hook returns.
+        Returns what the last render returned.
+        """
+        outcomes = []  # (source path, result, error) in drawing order
+
+        def record(source_paths, prepared_images):
+            for path, (result, error) in zip(source_paths, prepared_images):
+                outcomes.append((path, result, error))
+                yield result, error
+
+        result = render(record, True)
+        images = {i: BudgetImage(path, prepared, self.thumbnail_size, self.max_decode_bytes)
+                  for i, (path, prepared, error) in enumerate(outcomes) if error is None}
+        # Bytes each image took in the last render; the first one drew the derivatives
+        payload = sum(len(image.derivative[0]) for image in images.values())
+        levels = None
+
+        for _ in range(MAX_PASSES):
+            if result is None:
+                return None
+            size = os.path.getsize(output_pdf)
+            if size <= self.max_bytes:
+                logger.info(f"PDF is {size} bytes, within the budget of {self.max_bytes}")
+                return result
+            if not images:
+                break
+
+            overhead = size - payload
+            image_budget = self.max_bytes - overhead - SLACK_PER_IMAGE * len(images)
+            chosen = dict(zip(images, choose_levels(list(images.values()), image_budget)))
+            if chosen == levels:
+                break  # Nothing smaller to try
+            levels = chosen
+            payload = sum(image.size(levels[i]) for i, image in images.items())
+            logger.info(f"PDF is {size} bytes; re-encoding images for {image_budget} bytes "
+                        f"(levels {min(levels.values())}-{max(levels.values())})")
+
+            def replay(source_paths, prepared_images):
+                for i, (_, prepared, error) in enumerate(outcomes):
+                    yield (images[i].result(levels[i]), None) if i in images else (prepared, error)
+
+            result = render(replay, False)
+
+        logger.warning(f"PDF is {os.path.getsize(output_pdf)} bytes, over the budget of {self.max_bytes}")
+        return result
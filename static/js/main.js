@@ -3,6 +3,13 @@ let uploadedImages = [];
 let draggedElement = null;
 let draggedIndex = null;
 
+// Server limits, replaced by /config when it loads
+let clientConfig = {
+    max_request_bytes: 16 * 1024 * 1024,
+    max_batch_files: 50,
+    presize: { enabled: false }
+};
+
 // DOM elements
 const fileInput = document.getElementById('fileInput');
 const uploadBtn = document.getElementById('uploadBtn');
@@ -16,17 +23,38 @@ const imageCount = document.getElementById('imageCount');
 const generatePDF = document.getElementById('generatePDF');
 const clearAll = document.getElementById('clearAll');
 const pdfSection = document.getElementById('pdfSection');
+const pdfProgressText = document.getElementById('pdfProgressText');
 const imageModal = document.getElementById('imageModal');
 const modalImage = document.getElementById('modalImage');
 const modalClose = document.querySelector('.modal-close');
 const toastContainer = document.getElementById('toastContainer');
+const presizeOption = document.getElementById('presizeOption');
+const presizeToggle = document.getElementById('presizeToggle');
+const flatCaptionsToggle = document.getElementById('flatCaptionsToggle');
 
 // Initialize app
 document.addEventListener('DOMContentLoaded', function() {
     initializeEventListeners();
     updateUI();
+    loadClientConfig();
 });
 
+async function loadClientConfig() {
+    try {
+        const response = await fetch('/config');
+        if (response.ok) {
+            clientConfig = await response.json();
+        }
+    } catch (error) {
+        // Keep the defaults; uploads still work without presizing
+    }
+
+    if (clientConfig.presize.enabled && window.createImageBitmap) {
+        presizeToggle.checked = localStorage.getItem('presizeUploads') === '1';
+        presizeOption.style.display = 'flex';
+    }
+}
+
 // Event listeners
 function initializeEventListeners() {
     // File upload
@@ -49,6 +77,17 @@ function initializeEventListeners() {
         if (e.target === imageModal) closeModal();
     });
     
+    // Downscaling before upload is opt-in and remembered
+    presizeToggle.addEventListener('change', () => {
+        localStorage.setItem('presizeUploads', presizeToggle.checked ? '1' : '0');
+    });
+
+    // Static descriptions are remembered like the presize choice
+    flatCaptionsToggle.checked = localStorage.getItem('flatCaptions') === '1';
+    flatCaptionsToggle.addEventListener('change', () => {
+        localStorage.setItem('flatCaptions', flatCaptionsToggle.checked ? '1' : '0');
+    });
+
     // Keyboard shortcuts
     document.addEventListener('keydown', handleKeyboardShortcuts);
 }
@@ -84,9 +123,11 @@ function handleDrop(event) {
 }
 
 function processFiles(files) {
+    // Presized uploads are shrunk in the browser, so large originals are fine
+    const presize = clientConfig.presize.enabled && presizeToggle.checked;
     const validFiles = files.filter(file => {
         const isValidType = file.type.startsWith('image/');
-        const isValidSize = file.size <= 16 * 1024 * 1024; // 16MB
+        const isValidSize = presize || file.size <= 16 * 1024 * 1024; // 16MB
         
         if (!isValidType) {
             showToast('error', `Ugyldig filtype: ${file.name}`);
@@ -106,48 +147,167 @@ function processFiles(files) {
     uploadFiles(validFiles);
 }
 
+// Batched upload settings
+const UPLOAD_REQUEST_OVERHEAD = 1024 * 1024; // Headroom for multipart framing below the request limit
+const UPLOAD_CONCURRENCY = 3; // Batch requests in flight at once
+
+// Resize and re-encode an image in the browser to the size the PDF embeds.
+// Returns null when the original should be uploaded unchanged.
+async function presizeImage(file) {
+    const { max_width, max_height, quality } = clientConfig.presize;
+    const bitmap = await createImageBitmap(file);
+    const scale = Math.min(max_width / bitmap.width, max_height / bitmap.height, 1);
+    if (scale === 1) {
+        bitmap.close();
+        return null;
+    }
+
+    const canvas = document.createElement('canvas');
+    canvas.width = Math.min(max_width, Math.max(1, Math.round(bitmap.width * scale)));
+    canvas.height = Math.min(max_height, Math.max(1, Math.round(bitmap.height * scale)));
+    const context = canvas.getContext('2d');
+    // Transparent areas end up white, as on the server
+    context.fillStyle = '#ffffff';
+    context.fillRect(0, 0, canvas.width, canvas.height);
+    context.imageSmoothingQuality = 'high';
+    context.drawImage(bitmap, 0, 0, canvas.width, canvas.height);
+    bitmap.close();
+
+    const blob = await new Promise(resolve => canvas.toBlob(resolve, 'image/jpeg', quality / 100));
+    if (!blob) {
+        return null;
+    }
+    const name = file.name.replace(/\.[^.]+$/, '') + '.jpg';
+    return new File([blob], name, { type: 'image/jpeg' });
+}
+
+// Pair each file with what is actually sent: the original or a presized copy
+async function prepareUploads(files) {
+    const uploads = [];
+    const presize = clientConfig.presize.enabled && presizeToggle.checked;
+
+    for (let i = 0; i < files.length; i++) {
+        let presized = null;
+        if (presize) {
+            updateProgress(Math.round((i / files.length) * 100), `Forbereder billeder... (${i + 1}/${files.length})`);
+            try {
+                presized = await presizeImage(files[i]);
+            } catch (error) {
+                // Formats the browser cannot decode are uploaded as they are
+            }
+        }
+        uploads.push({ file: presized || files[i], presized: presized !== null });
+    }
+    return uploads;
+}
+
+function makeUploadBatches(uploads) {
+    const maxBytes = clientConfig.max_request_bytes - UPLOAD_REQUEST_OVERHEAD;
+    const batches = [];
+    let batch = [];
+    let batchBytes = 0;
+
+    uploads.forEach(upload => {
+        if (batch.length > 0 &&
+            (batchBytes + upload.file.size > maxBytes || batch.length >= clientConfig.max_batch_files)) {
+            batches.push(batch);
+            batch = [];
+            batchBytes = 0;
+        }
+        batch.push(upload);
+        batchBytes += upload.file.size;
+    });
+    if (batch.length > 0) {
+        batches.push(batch);
+    }
+    return batches;
+}
+
+async function uploadBatch(batch) {
+    const formData = new FormData();
+    batch.forEach(upload => {
+        formData.append('files', upload.file);
+        formData.append('presized', upload.presized ? '1' : '0');
+    });
+
+    try {
+        const response = await fetch('/upload-batch', {
+            method: 'POST',
+            body: formData
+        });
+        const result = await response.json();
+        if (response.ok && result.results) {
+            return result.results;
+        }
+        return batch.map(() => ({ success: false, error: result.error }));
+    } catch (error) {
+        return batch.map(() => ({ success: false, error: 'Fejl ved upload: ' + error.message }));
+    }
+}
+
 async function uploadFiles(files) {
     showProgress();
-    
-    try {
-        for (let i = 0; i < files.length; i++) {
-            const file = files[i];
-            const formData = new FormData();
-            formData.append('file', file);
-            
-            const response = await fetch('/upload', {
-                method: 'POST',
-                body: formData
+
+    const batches = makeUploadBatches(await prepareUploads(files));
+    const batchResults = new Array(batches.length);
+    let nextBatch = 0;
+    let nextToShow = 0;
+    let filesDone = 0;
+    let filesUploaded = 0;
+
+    // Add finished batches to the gallery in the order the files were chosen
+    function showFinishedBatches() {
+        while (nextToShow < batches.length && batchResults[nextToShow]) {
+            const batch = batches[nextToShow];
+            batchResults[nextToShow].forEach((result, i) => {
+                const file = batch[i].file;
+                if (result.success) {
+                    // Create image object
+                    const imageObj = {
+                        id: Date.now() + Math.random(),
+                        filename: result.filename,
+                        originalName: result.original_name,
+                        description: '',
+                        file: file
+                    };
+
+                    uploadedImages.push(imageObj);
+                    addImageToGallery(imageObj);
+                    filesUploaded++;
+                } else {
+                    showToast('error', result.error || `Upload fejlede: ${file.name}`);
+                }
             });
-            
-            const result = await response.json();
-            
-            if (response.ok && result.success) {
-                // Create image object
-                const imageObj = {
-                    id: Date.now() + Math.random(),
-                    filename: result.filename,
-                    originalName: result.original_name,
-                    description: '',
-                    file: file
-                };
-                
-                uploadedImages.push(imageObj);
-                addImageToGallery(imageObj);
-                showToast('success', `Uploadet: ${result.original_name}`);
-            } else {
-                showToast('error', result.error || `Upload fejlede: ${file.name}`);
-            }
-            
+            nextToShow++;
+        }
+    }
+
+    async function uploadWorker() {
+        while (nextBatch < batches.length) {
+            const index = nextBatch++;
+            batchResults[index] = await uploadBatch(batches[index]);
+            showFinishedBatches();
+
             // Update progress
-            const progress = Math.round(((i + 1) / files.length) * 100);
-            updateProgress(progress, `Uploader... (${i + 1}/${files.length})`);
+            filesDone += batches[index].length;
+            const progress = Math.round((filesDone / files.length) * 100);
+            updateProgress(progress, `Uploader... (${filesDone}/${files.length})`);
         }
-        
+    }
+
+    try {
+        const workers = [];
+        for (let i = 0; i < Math.min(UPLOAD_CONCURRENCY, batches.length); i++) {
+            workers.push(uploadWorker());
+        }
+        await Promise.all(workers);
+
         hideProgress();
         updateUI();
-        showToast('success', `Uploadet ${files.length} filer succesfuldt`);
-        
+        if (filesUploaded > 0) {
+            showToast('success', `Uploadet ${filesUploaded} af ${files.length} filer`);
+        }
+
     } catch (error) {
         hideProgress();
         showToast('error', 'Fejl ved upload: ' + error.message);
@@ -362,12 +522,24 @@ async function generatePDFFile() {
             headers: {
                 'Content-Type': 'application/json',
             },
-            body: JSON.stringify({ images })
+            body: JSON.stringify({
+                images,
+                // Filled-in descriptions as static text, empty ones as editable fields
+                caption_mode: flatCaptionsToggle.checked ? 'mixed' : 'fields'
+            })
         });
         
-        const result = await response.json();
+        const job = await response.json();
         
-        if (response.ok && result.success) {
+        if (!response.ok || !job.success) {
+            showToast('error', job.error || 'Fejl ved PDF-generering');
+            return;
+        }
+        
+        // Wait for the background job to finish; a PDF reused by the server is done already
+        const result = isJobFinished(job) ? job : await waitForPDFJob(job);
+        
+        if (result.status === 'done') {
             // Auto download
             const link = document.createElement('a');
             link.href = result.download_url;
@@ -376,7 +548,15 @@ async function generatePDFFile() {
             link.click();
             document.body.removeChild(link);
             
-            showToast('success', 'PDF genereret og downloadstartet!');
+            if (result.images_failed > 0) {
+                showToast('warning', `${result.images_failed} af ${result.images_total} billeder kunne ikke læses og er udeladt af PDF'en`, 8000);
+            }
+            if (result.within_budget === false) {
+                showToast('warning', `PDF'en er ${formatFileSize(result.file_size)} og kunne ikke komme under ${formatFileSize(result.max_size)}`, 8000);
+            }
+            if (!(result.images_failed > 0) && result.within_budget !== false) {
+                showToast('success', 'PDF genereret og downloadstartet!');
+            }
         } else {
             showToast('error', result.error || 'Fejl ved PDF-generering');
         }
@@ -387,6 +567,62 @@ async function generatePDFFile() {
         generatePDF.disabled = false;
         generatePDF.innerHTML = '<i class="fas fa-file-pdf"></i> Generer PDF';
         pdfSection.style.display = 'none';
+        pdfProgressText.textContent = '';
+    }
+}
+
+function isJobFinished(status) {
+    return status.status === 'done' || status.status === 'failed';
+}
+
+function updatePDFProgress(status) {
+    if (status.status === 'queued') {
+        pdfProgressText.textContent = 'I kø...';
+    } else if (status.status === 'running') {
+        pdfProgressText.textContent = `Behandler billede ${status.images_processed} af ${status.images_total} (side ${status.pages})`;
+    }
+}
+
+// Follow job progress via Server-Sent Events, falling back to polling
+function waitForPDFJob(job) {
+    if (!window.EventSource) {
+        return pollPDFJob(job.status_url);
+    }
+    
+    return new Promise((resolve, reject) => {
+        const source = new EventSource(job.events_url);
+        
+        source.onmessage = function(event) {
+            const status = JSON.parse(event.data);
+            updatePDFProgress(status);
+            if (isJobFinished(status)) {
+                source.close();
+                resolve(status);
+            }
+        };
+        
+        source.onerror = function() {
+            source.close();
+            pollPDFJob(job.status_url).then(resolve, reject);
+        };
+    });
+}
+
+async function pollPDFJob(statusUrl) {
+    while (true) {
+        const response = await fetch(statusUrl);
+        const status = await response.json();
+        
+        if (!response.ok) {
+            throw new Error(status.error || 'Ukendt fejl');
+        }
+        
+        updatePDFProgress(status);
+        if (isJobFinished(status)) {
+            return status;
+        }
+        
+        await new Promise(resolve => setTimeout(resolve, 1000));
     }
 }
 
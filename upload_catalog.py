@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Persistent catalog of the files in the upload folder.
+
+Every stored upload is recorded with its owner session, content digest,
+header metadata and the time it expires; generated PDFs are recorded with
+their owner and expiry. Cleanup asks the expiry index for due files instead
+of scanning the folder, and PDF generation trusts the validation done at
+upload instead of verifying every image again.
+"""
+
+import os
+import time
+import sqlite3
+import threading
+
+KIND_UPLOAD = 'upload'
+KIND_PDF = 'pdf'
+
+
+class UploadCatalog:
+    """Catalog of upload folder files in a SQLite database"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        with self._connect() as db:
+            db.executescript("""
+                CREATE TABLE IF NOT EXISTS files (
+                    filename TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    session_id TEXT NOT NULL,
+                    digest TEXT,
+                    format TEXT,
+                    mode TEXT,
+                    width INTEGER,
+                    height INTEGER,
+                    size INTEGER,
+                    validated INTEGER NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL,
+                    expires_at REAL NOT NULL,
+                    manifest_digest TEXT
+                );
+                CREATE INDEX IF NOT EXISTS files_expires_at ON files (expires_at);
+            """)
+            # Catalogs created before PDFs were memoized lack the manifest column
+            columns = {row['name'] for row in db.execute("PRAGMA table_info(files)")}
+            if 'manifest_digest' not in columns:
+                db.execute("ALTER TABLE files ADD COLUMN manifest_digest TEXT")
+            db.execute("CREATE INDEX IF NOT EXISTS files_manifest_digest ON files (manifest_digest)")
+
+    def _connect(self):
+        """One connection per thread; SQLite connections are not shared between threads"""
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.db_path, timeout=30)
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA journal_mode=WAL")
+            self._local.db = db
+        return db
+
+    def add_upload(self, filename, session_id, ingested, expires_at):
+        """Record an upload that passed validation during ingest"""
+        with self._connect() as db:
+            db.execute("""
+                INSERT OR REPLACE INTO files (filename, kind, session_id, digest, format, mode,
+                                              width, height, size, validated, created_at, expires_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 1, ?, ?)
+            """, (filename, KIND_UPLOAD, session_id, ingested.digest, ingested.format, ingested.mode,
+                  ingested.width, ingested.height, ingested.size, time.time(), expires_at))
+
+    def add_file(self, filename, kind, session_id, expires_at, size=None, manifest_digest=None, digest=None):
+        """
+        Record a file without image metadata, e.g. a generated PDF; manifest_digest
+        identifies the input a PDF was generated from, digest its content
+        """
+        with self._connect() as db:
+            db.execute("""
+                INSERT OR REPLACE INTO files (filename, kind, session_id, digest, size, created_at, expires_at,
+                                              manifest_digest)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, (filename, kind, session_id, digest, size, time.time(), expires_at, manifest_digest))
+
+    def find_by_manifest(self, manifest_digest):
+        """Filenames of files generated from the given manifest, newest first"""
+        rows = self._connect().execute(
+            "SELECT filename FROM files WHERE manifest_digest = ? ORDER BY created_at DESC",
+            (manifest_digest,)).fetchall()
+        return [row['filename'] for row in rows]
+
+    def get_many(self, filenames):
+        """Catalog entries for the given filenames as {filename: dict}; unknown names are left out"""
+        entries = {}
+        filenames = list(filenames)
+        db = self._connect()
+        # Stay below SQLite's limit on bound parameters
+        for start in range(0, len(filenames), 500):
+            chunk = filenames[start:start + 500]
+            rows = db.execute(f"SELECT * FROM files WHERE filename IN ({','.join('?' * len(chunk))})",
+                              chunk).fetchall()
+            entries.update((row['filename'], dict(row)) for row in rows)
+        return entries
+
+    def contains(self, filename):
+        row = self._connect().execute("SELECT 1 FROM files WHERE filename = ?", (filename,)).fetchone()
+        return row is not None
+
+    def remove(self, filename):
+        with self._connect() as db:
+            db.execute("DELETE FROM files WHERE filename = ?", (filename,))
+
+    def expired(self, now=None):
+        """Filenames whose expiry time has passed, oldest first, read from the expiry index"""
+        if now is None:
+            now = time.time()
+        rows = self._connect().execute(
+            "SELECT filename FROM files WHERE expires_at <= ? ORDER BY expires_at",
+            (now,)).fetchall()
+        return [row['filename'] for row in rows]
+
+    def add_untracked(self, folder, kind_for, lifetime):
+        """
+        Record regular files in folder that are not in the catalog yet, expiring
+        `lifetime` seconds after their modification time. Used once at startup
+        to pick up files from before the catalog existed.
+        """
+        added = 0
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if not entry.is_file() or self.contains(entry.name):
+                    continue
+                st = entry.stat()
+                kind, session_id = kind_for(entry.name)
+                self.add_file(entry.name, kind, session_id, st.st_mtime + lifetime, size=st.st_size)
+                added += 1
+        return added
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Single-pass ingest of uploaded image files.
+
+The multipart parser writes each uploaded file straight into an IngestStream
+in the upload folder. Every chunk is hashed, written to disk and, for the
+first HEADER_BYTES, kept for format sniffing and header parsing, so an
+upload is read exactly once and memory use stays bounded per upload.
+Uploads are rejected from their header alone when they exceed the pixel
+limit or could not be decoded within the decode memory budget.
+"""
+
+import os
+import io
+import hashlib
+import logging
+import tempfile
+from PIL import Image
+from image_probe import ImageTooLargeError, probe_image, check_decodable
+
+logger = logging.getLogger(__name__)
+
+# Leading bytes kept in memory for sniffing and parsing the image header
+HEADER_BYTES = 256 * 1024
+INGEST_PREFIX = '.ingest_'
+INGEST_SUFFIX = '.part'
+
+# Formats that only list their frames by walking the whole file
+FRAME_SCAN_FORMATS = ('GIF',)
+
+# Magic numbers of the accepted formats
+SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'BM', 'image/bmp'),
+)
+
+
+class IngestError(Exception):
+    """Raised when an ingested upload is not an acceptable image"""
+
+
+def sniff_mime_type(header):
+    """MIME type from the leading bytes of a file, or None if unrecognised"""
+    for signature, mime_type in SIGNATURES:
+        if header.startswith(signature):
+            return mime_type
+    return None
+
+
+class IngestResult:
+    """Digest and header metadata of an ingested upload"""
+
+    def __init__(self, digest, size, mime_type, image_format, mode, width, height, frames=1):
+        self.digest = digest
+        self.size = size
+        self.mime_type = mime_type
+        self.format = image_format
+        self.mode = mode
+        self.width = width
+        self.height = height
+        self.frames = frames
+
+
+class IngestStream:
+    """
+    Writable and readable temporary file that hashes and sniffs data as it is
+    written. Closing it removes the file; keep the data by linking it elsewhere.
+    max_decode_bytes is the decode budget checked by inspect().
+    """
+
+    def __init__(self, directory, max_decode_bytes=None):
+        self.max_decode_bytes = max_decode_bytes
+        fd, self.path = tempfile.mkstemp(dir=directory, prefix=INGEST_PREFIX,
+                                         suffix=INGEST_SUFFIX)
+        self._file = os.fdopen(fd, 'w+b')
+        self._hash = hashlib.sha256()
+        self._header = bytearray()
+        self.size = 0
+
+    def write(self, data):
+        self._hash.update(data)
+        if len(self._header) < HEADER_BYTES:
+            self._header += data[:HEADER_BYTES - len(self._header)]
+        self.size += len(data)
+        return self._file.write(data)
+
+    def __getattr__(self, name):
+        # read, seek, tell, readline and friends go to the underlying file
+        return getattr(self._file, name)
+
+    def inspect(self):
+        """Identify the written data from the buffered header"""
+        header = bytes(self._header)
+        mime_type = sniff_mime_type(header)
+        if mime_type is None:
+            raise IngestError("Unknown file format")
+
+        try:
+            probe = self._probe(header)
+            if self.max_decode_bytes is not None:
+                check_decodable(probe, self.max_decode_bytes)
+        except ImageTooLargeError as e:
+            raise IngestError(f"Image too large: {e}")
+
+        if Image.MIME.get(probe.format) != mime_type:
+            raise IngestError("File content does not match its format")
+        return IngestResult(self._hash.hexdigest(), self.size, mime_type, probe.format,
+                            probe.mode, probe.width, probe.height, probe.frames)
+
+    def _probe(self, header):
+        """Probe the buffered header, reading the file from disk only when it is not enough"""
+        try:
+            probe = probe_image(io.BytesIO(header))
+            if self.size <= len(header) or (probe.frames is not None
+                                            and probe.format not in FRAME_SCAN_FORMATS):
+                return probe
+        except ImageTooLargeError:
+            raise
+        except Exception:
+            if self.size <= len(header):
+                raise IngestError("Unreadable image header")
+
+        # Header or frame list extends past the buffered bytes
+        self._file.flush()
+        try:
+            return probe_image(self.path)
+        except ImageTooLargeError:
+            raise
+        except Exception as e:
+            raise IngestError(f"Unreadable image header: {e}")
+
+    def close(self):
+        self._file.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass